@@ -0,0 +1,109 @@
+import heapq
+import time
+
+from django.utils import timezone
+
+from companies.models import Service
+from freight_terminal.transitions import TransitionError, transition
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+class ArrivalScheduler:
+    """
+    Move not started services to waiting when their arrival datetime is reached, one transition per service.
+
+    Arrivals are kept in a heap, so only services which are due are looked at. Not started services are loaded
+    once, later only new and rescheduled services, which are marked for scheduling when saved, are taken.
+    Every transition is guarded by the arrival datetime it was scheduled for, so a service rescheduled
+    before the scheduler takes it again does not arrive early.
+    """
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.heap = []
+        # The latest known arrival of every scheduled service, heap entries with other arrivals are stale
+        self.arrivals = {}
+
+    def schedule(self, service_id, arrival_datetime):
+        if self.arrivals.get(service_id) != arrival_datetime:
+            self.arrivals[service_id] = arrival_datetime
+            heapq.heappush(self.heap, (arrival_datetime, service_id))
+
+    def _drop_stale(self):
+        while self.heap and self.arrivals.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def load(self):
+        """
+        Schedule all not started services.
+        """
+        services = Service.objects.filter(status=Service.Status.NOT_STARTED).values_list('pk', 'arrival_datetime')
+        for service_id, arrival_datetime in services.iterator():
+            self.schedule(service_id, arrival_datetime)
+
+    def refresh(self):
+        """
+        Take services marked for scheduling until there are none left. Returns the number of taken services.
+        """
+        taken = 0
+
+        while True:
+            services = Service.objects.take_unscheduled(self.batch_size)
+            for service_id, status, arrival_datetime in services:
+                if status == Service.Status.NOT_STARTED:
+                    self.schedule(service_id, arrival_datetime)
+                else:
+                    self.arrivals.pop(service_id, None)
+
+            taken += len(services)
+            if len(services) < self.batch_size:
+                return taken
+
+    def fire_due(self, now=None):
+        """
+        Move services which arrival datetime is reached to waiting. Returns ids of moved services.
+        """
+        now = now or timezone.now()
+        arrived = []
+
+        self._drop_stale()
+        while self.heap and self.heap[0][0] <= now:
+            arrival_datetime, service_id = heapq.heappop(self.heap)
+            del self.arrivals[service_id]
+            self._drop_stale()
+
+            try:
+                transition(Service, 'arrive', [service_id], arrival_datetime=arrival_datetime)
+            except TransitionError:
+                # Service is started or rescheduled meanwhile
+                continue
+            arrived.append(service_id)
+
+        return arrived
+
+    def get_timeout(self, interval, now=None):
+        """
+        Seconds until the next arrival, at most `interval`.
+        """
+        self._drop_stale()
+        if not self.heap:
+            return interval
+
+        now = now or timezone.now()
+        return max(0, min(interval, (self.heap[0][0] - now).total_seconds()))
+
+    def run(self, interval, on_arrived=None):
+        """
+        Move services to waiting until interrupted, taking new and rescheduled services every `interval` seconds
+        at most.
+        """
+        self.load()
+
+        while True:
+            self.refresh()
+            arrived = self.fire_due()
+
+            if on_arrived and arrived:
+                on_arrived(arrived)
+
+            time.sleep(self.get_timeout(interval))
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+from companies.capacity import forecast_capacity
+from freight_terminal.cache import LRUCache
+
+# Capacity forecasts by `(company id, since, until)`, invalidated by signals when a service or robot changes
+capacity_forecasts = LRUCache(lambda key: forecast_capacity(*key), max_size=settings.CAPACITY_CACHE_SIZE,
+                              ttl=settings.CAPACITY_CACHE_TTL)
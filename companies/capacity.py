@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour
+
+from companies.models import Robot, Service
+
+DEFAULT_CAPACITY_PERIOD = timedelta(days=3)
+MAX_CAPACITY_PERIOD = timedelta(days=31)
+HOUR = timedelta(hours=1)
+
+
+def forecast_capacity(company_id, since, until):
+    """
+    Return per hour numbers of arriving services and busy robots of every type of the company from `since`
+    until `until`, which must be whole hours, along with the number of robots of the type which are available.
+
+    Services are counted with one query grouped by robot and hour of arrival. Bookings of a robot never overlap,
+    so the robot is busy from the hour of arrival until the latest departure of its services arriving in that hour.
+    Busy robots are counted with a difference array over hours, O(rows + hours).
+    """
+    hours_count = (until - since) // HOUR
+    robot_types = Robot.Type.values
+
+    services = (Service.objects
+                .with_departure()
+                .filter(robot__company_id=company_id, arrival_datetime__lt=until, departure_datetime__gt=since)
+                .annotate(hour=TruncHour('arrival_datetime'))
+                .order_by('robot', 'hour')
+                .values('robot__type', 'robot', 'hour')
+                .annotate(arrivals=Count('pk'), departure=Max('departure_datetime'))
+                .values_list('robot__type', 'robot', 'hour', 'arrivals', 'departure'))
+
+    arrivals = np.zeros((len(robot_types), hours_count), dtype=np.int64)
+    busy_changes = np.zeros((len(robot_types), hours_count + 1), dtype=np.int64)
+    # Hours until which robots are already counted as busy, so a robot is counted once per hour
+    busy_until = {}
+
+    for robot_type, robot_id, hour, arrivals_count, departure in services:
+        type_index = robot_types.index(robot_type)
+        start = (hour - since) // HOUR
+        end = min(-((since - departure) // HOUR), hours_count)
+
+        if start >= 0:
+            arrivals[type_index, start] += arrivals_count
+
+        start = max(start, busy_until.get(robot_id, 0))
+        if start < end:
+            busy_changes[type_index, start] += 1
+            busy_changes[type_index, end] -= 1
+            busy_until[robot_id] = end
+
+    busy = np.cumsum(busy_changes[:, :-1], axis=1)
+    fleet_sizes = dict(Robot.objects
+                       .filter(company_id=company_id)
+                       .exclude(status=Robot.Status.UNAVAILABLE)
+                       .order_by()
+                       .values('type')
+                       .annotate(count=Count('pk'))
+                       .values_list('type', 'count'))
+
+    return {
+        'since': since,
+        'until': until,
+        'robot_types': [{
+            'robot_type': robot_type,
+            'fleet_size': fleet_sizes.get(robot_type, 0),
+            'hours': [{
+                'hour': since + hour_index * HOUR,
+                'arrivals': int(arrivals[type_index, hour_index]),
+                'busy_robots': int(busy[type_index, hour_index]),
+                # Negative when more robots are booked than available
+                'free_robots': fleet_sizes.get(robot_type, 0) - int(busy[type_index, hour_index]),
+            } for hour_index in range(hours_count)],
+        } for type_index, robot_type in enumerate(robot_types)],
+    }
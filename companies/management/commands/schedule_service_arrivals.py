@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from companies.arrivals import DEFAULT_BATCH_SIZE, ArrivalScheduler
+
+
+class Command(BaseCommand):
+    help = 'Continuously move not started services to waiting when their arrival datetime is reached'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Maximum number of new and rescheduled services taken at once')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Maximum seconds to wait before taking new and rescheduled services')
+        parser.add_argument('--once', action='store_true', help='Move services which are due and exit')
+
+    def handle(self, *args, **options):
+        scheduler = ArrivalScheduler(batch_size=options['batch_size'])
+
+        if options['once']:
+            scheduler.load()
+            scheduler.refresh()
+            self.report(scheduler.fire_due())
+        else:
+            scheduler.run(options['interval'], on_arrived=self.report)
+
+    def report(self, service_ids):
+        self.stdout.write(self.style.SUCCESS(f'{len(service_ids)} services arrived'))
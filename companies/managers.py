@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from freight_terminal.events import publish_changes
+
+
+class RobotQuerySet(models.QuerySet):
+    def reserve(self, company, robot_type, arrival_datetime, duration=None):
+        """
+        Mark a free robot of the type from the company, which is not booked for the period from `arrival_datetime`
+        for `duration`, as busy and return it, or None if there is no such robot. Must be called in a transaction,
+        which keeps the robot row locked until it ends.
+
+        Free robots locked by concurrent reservations are skipped rather than waited for, so concurrent
+        reservations take different robots without queueing behind each other. Status is changed with an UPDATE
+        guarded by the free status, so a robot is never reserved twice even where rows can not be locked.
+        Bookings are checked with the robot row locked, as services are only booked with it locked.
+        """
+        Service = apps.get_model('companies', 'Service')
+        free_robots = self.select_for_update(skip_locked=True).filter(company=company, type=robot_type,
+                                                                      status=self.model.Status.FREE).order_by('pk')
+        booked_robot_ids = []
+
+        while True:
+            robot = free_robots.exclude(pk__in=booked_robot_ids).first()
+            if robot is None:
+                return None
+
+            if Service.objects.find_conflict(robot, arrival_datetime, duration):
+                booked_robot_ids.append(robot.pk)
+                continue
+
+            if self.filter(pk=robot.pk, status=self.model.Status.FREE).update(status=self.model.Status.BUSY):
+                robot.status = self.model.Status.BUSY
+                publish_changes(self.model, robot.pk, {'status': robot.status})
+                return robot
+
+
+class RobotManager(models.Manager.from_queryset(RobotQuerySet)):
+    pass
+
+
+class ServiceQuerySet(models.QuerySet):
+    def with_departure(self):
+        """
+        Annotate services with `departure_datetime`, end of the period their robot is booked for.
+        """
+        duration = Coalesce('duration', models.Value(timedelta(minutes=settings.SERVICE_DURATION)),
+                            output_field=models.DurationField())
+        return self.annotate(departure_datetime=models.ExpressionWrapper(models.F('arrival_datetime') + duration,
+                                                                         output_field=models.DateTimeField()))
+
+    def find_conflict(self, robot, arrival_datetime, duration=None, exclude=None):
+        """
+        Return a service of the robot booked for a period overlapping the period from `arrival_datetime`
+        for `duration`, or None if the robot is free then. Service `exclude` is not checked against.
+
+        Every service arriving before the end of the period is checked rather than only the last one, as periods
+        of services booked before they were checked, or of services without their own duration after
+        `SERVICE_DURATION` was raised, can overlap, and a long booking can be hidden behind a shorter later one.
+        Services are scanned backward over the robot and arrival datetime index until the first overlapping one.
+        """
+        departure_datetime = arrival_datetime + (duration or timedelta(minutes=settings.SERVICE_DURATION))
+        services = self.filter(robot=robot, arrival_datetime__lt=departure_datetime)
+        if exclude is not None:
+            services = services.exclude(pk=exclude.pk)
+
+        return (services.with_departure().filter(departure_datetime__gt=arrival_datetime)
+                .order_by('-arrival_datetime').first())
+
+    def dispatch(self, company, robot_type, **fields):
+        """
+        Create a service done by a free robot of the type from the company, reserving the robot in the same
+        transaction. Returns None if there is no free robot which is not booked for the time of the service.
+        """
+        Robot = apps.get_model('companies', 'Robot')
+
+        with transaction.atomic():
+            robot = Robot.objects.reserve(company, robot_type, fields['arrival_datetime'], fields.get('duration'))
+            if robot is None:
+                return None
+            return self.create(robot=robot, **fields)
+
+    def take_unscheduled(self, limit):
+        """
+        Mark at most `limit` services as scheduled and return their `(id, status, arrival_datetime)`.
+
+        Services are locked until they are marked, so a service saved meanwhile is marked for scheduling again
+        rather than lost, and services locked by a concurrent scheduler are skipped.
+        """
+        with transaction.atomic():
+            services = list(self.select_for_update(skip_locked=True).filter(is_scheduled=False).order_by('pk')
+                            .values_list('pk', 'status', 'arrival_datetime')[:limit])
+            self.filter(pk__in=[service[0] for service in services]).update(is_scheduled=True)
+
+        return services
+
+
+class ServiceManager(models.Manager.from_queryset(ServiceQuerySet)):
+    pass
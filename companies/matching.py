@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.db import transaction
+
+from companies.models import Robot, Service, Transfer
+
+DEFAULT_MAX_GAP = timedelta(hours=24)
+FINISHED_STATUSES = [Service.Status.DONE, Service.Status.RETURNING_FREIGHT, Service.Status.RETURNED_FREIGHT]
+
+
+def pair_services(deliveries, receptions, max_gap):
+    """
+    Pair `(id, robot_type, arrival_datetime)` deliveries with receptions in a single sweep over their arrival
+    datetimes, O(n log n) for sorting and O(n) for the sweep.
+
+    Every reception takes the delivery which arrived last before it, no more than `max_gap` earlier, among
+    unpaired deliveries by robots of types which can hand freight over to its robot. Returns `(delivery id,
+    reception id)` pairs.
+    """
+    # Deliveries go before receptions arriving at the same time, so they can be paired
+    events = sorted([(arrival_datetime, 0, service_id, robot_type)
+                     for service_id, robot_type, arrival_datetime in deliveries] +
+                    [(arrival_datetime, 1, service_id, robot_type)
+                     for service_id, robot_type, arrival_datetime in receptions])
+    delivering_types = {robot_type: [delivery_type for delivery_type, reception_types
+                                     in Robot.COMPATIBLE_TYPES.items() if robot_type in reception_types]
+                        for robot_type in Robot.Type.values}
+
+    # Unpaired deliveries per robot type, the latest on top
+    pending = {robot_type: [] for robot_type in Robot.Type.values}
+    pairs = []
+
+    for arrival_datetime, is_reception, service_id, robot_type in events:
+        if not is_reception:
+            pending[robot_type].append((arrival_datetime, service_id))
+            continue
+
+        candidates = [delivery_type for delivery_type in delivering_types[robot_type]
+                      if pending[delivery_type] and arrival_datetime - pending[delivery_type][-1][0] <= max_gap]
+        if candidates:
+            delivery_type = max(candidates, key=lambda delivery_type: pending[delivery_type][-1][0])
+            pairs.append((pending[delivery_type].pop()[1], service_id))
+
+    return pairs
+
+
+def match_services(max_gap=DEFAULT_MAX_GAP):
+    """
+    Create transfers for unfinished delivery and reception services which are not in a transfer yet,
+    pairing them with `pair_services`. Returns `(delivery id, reception id)` pairs of created transfers and ids
+    of services left unpaired.
+
+    Services are locked until transfers are created, services locked by a concurrent matching are skipped.
+    """
+    services = (Service.objects
+                .select_for_update(skip_locked=True, of=('self',))
+                .exclude(status__in=FINISHED_STATUSES)
+                .order_by('pk'))
+
+    with transaction.atomic():
+        deliveries = list(services.filter(type=Service.Type.DELIVERY, delivery_transfer__isnull=True)
+                          .values_list('pk', 'robot__type', 'arrival_datetime'))
+        receptions = list(services.filter(type=Service.Type.RECEPTION, reception_transfer__isnull=True)
+                          .values_list('pk', 'robot__type', 'arrival_datetime'))
+
+        pairs = pair_services(deliveries, receptions, max_gap)
+        Transfer.objects.bulk_create([Transfer(delivery_service_id=delivery_id, reception_service_id=reception_id)
+                                      for delivery_id, reception_id in pairs], batch_size=1000)
+
+    paired_ids = {service_id for pair in pairs for service_id in pair}
+    unpaired_ids = [service_id for service_id, robot_type, arrival_datetime in deliveries + receptions
+                    if service_id not in paired_ids]
+
+    return pairs, sorted(unpaired_ids)
@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0005_auto_20210430_2139'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='duration',
+            field=models.DurationField(blank=True, null=True, verbose_name='duration'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['robot', 'arrival_datetime'], name='service_robot_arrival_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0006_service_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='is_scheduled',
+            field=models.BooleanField(default=False, verbose_name='is scheduled'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(condition=models.Q(status='not_started'), fields=['arrival_datetime'], name='service_not_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(condition=models.Q(is_scheduled=False), fields=['id'], name='service_unscheduled_idx'),
+        ),
+    ]
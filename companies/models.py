@@ -4,6 +4,9 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from freight_terminal import settings
+from companies.managers import RobotManager, ServiceManager
+from freight_terminal.events import BroadcastChangesMixin
+from freight_terminal.transitions import Transition, transition
 
 
 class Company(models.Model):
@@ -23,7 +26,7 @@ class Company(models.Model):
         return self.name
 
 
-class Robot(models.Model):
+class Robot(BroadcastChangesMixin, models.Model):
     class Type(models.TextChoices):
         SEA = 'sea', _('Sea')
         AIR = 'air', _('Air')
@@ -34,24 +37,38 @@ class Robot(models.Model):
         FREE = 'free', _('Free')
         UNAVAILABLE = 'unavailable', _('Unavailable')
 
+    # Types of robots which can take freight over from a robot of the type at the terminal
+    COMPATIBLE_TYPES = {
+        Type.SEA: [Type.SEA, Type.LAND],
+        Type.AIR: [Type.AIR, Type.LAND],
+        Type.LAND: [Type.SEA, Type.AIR, Type.LAND],
+    }
+    # A busy robot can take more services which are not started yet
+    TRANSITIONS = {
+        'start_transit': Transition(sources=[Status.FREE, Status.BUSY], target=Status.BUSY),
+        'finish_transit': Transition(sources=[Status.BUSY], target=Status.FREE),
+    }
+
     model = models.CharField(_('model'), max_length=50)
     type = models.CharField(_('type'), max_length=30, choices=Type.choices)
     company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='robots')
     status = models.CharField(_('status'), max_length=30, choices=Status.choices, default=Status.FREE)
 
+    objects = RobotManager()
+
+    broadcast_fields = ('status',)
+
     def __str__(self):
         return f'{self.model}({self.company})'
 
     def start_transit(self):
-        self.status = Robot.Status.BUSY
-        self.save()
+        self.status = transition(Robot, 'start_transit', [self.pk])
 
     def finish_transit(self):
-        self.status = Robot.Status.FREE
-        self.save()
+        self.status = transition(Robot, 'finish_transit', [self.pk])
 
 
-class Service(models.Model):
+class Service(BroadcastChangesMixin, models.Model):
     class Type(models.TextChoices):
         DELIVERY = 'delivery', _('Delivery')
         RECEPTION = 'reception', _('Reception')
@@ -71,24 +88,58 @@ class Service(models.Model):
         RETURNING_FREIGHT = 'returning_freight', _('Returning freight')
         RETURNED_FREIGHT = 'returned_freight', _('Returned freight')
 
+    TRANSITIONS = {
+        'start_freight_return': Transition(sources=[Status.NOT_STARTED, Status.WAITING, Status.DONE,
+                                                    Status.IN_TRANSIT_WITHOUT_FREIGHT, Status.IN_TRANSIT_WITH_FREIGHT,
+                                                    Status.TRANSFERING],
+                                           target=Status.RETURNING_FREIGHT),
+        'finish_freight_return': Transition(sources=[Status.RETURNING_FREIGHT], target=Status.RETURNED_FREIGHT),
+        'arrive': Transition(sources=[Status.NOT_STARTED], target=Status.WAITING),
+    }
+
     arrival_datetime = models.DateTimeField(_('arrival datetime'))
     robot = models.ForeignKey('Robot', on_delete=models.CASCADE, related_name='services')
     type = models.CharField(_('type'), max_length=30, choices=Type.choices)
     status = models.CharField(_('status'), max_length=30, choices=Status.choices, default=Status.NOT_STARTED)
+    duration = models.DurationField(_('duration'), null=True, blank=True)
+    # Cleared when a not started service is saved and set by arrival scheduler when it takes the service
+    is_scheduled = models.BooleanField(_('is scheduled'), default=False)
+
+    objects = ServiceManager()
+
+    broadcast_fields = ('status',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['robot', 'arrival_datetime'], name='service_robot_arrival_idx'),
+            models.Index(fields=['arrival_datetime'], condition=models.Q(status='not_started'),
+                         name='service_not_started_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_scheduled=False), name='service_unscheduled_idx'),
+        ]
 
     def __str__(self):
         return f'{self.type} by {self.robot}'
 
+    def save(self, *args, **kwargs):
+        # Arrival scheduler takes the service again, so a new arrival datetime is picked up
+        if self.status == Service.Status.NOT_STARTED:
+            self.is_scheduled = False
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'is_scheduled'}
+
+        super().save(*args, **kwargs)
+
     def is_started(self):
         return self.status != Service.Status.NOT_STARTED
 
+    def arrive(self):
+        self.status = transition(Service, 'arrive', [self.pk])
+
     def start_freight_return(self):
-        self.status = self.Status.RETURNING_FREIGHT
-        self.save()
+        self.status = transition(Service, 'start_freight_return', [self.pk])
 
     def finish_freight_return(self):
-        self.status = self.Status.RETURNED_FREIGHT
-        self.save()
+        self.status = transition(Service, 'finish_freight_return', [self.pk])
 
 
 class Transfer(models.Model):
@@ -107,10 +158,8 @@ class Transfer(models.Model):
         return transfers.exists()
 
     def start_freight_return(self):
-        self.delivery_service.start_freight_return()
-        self.reception_service.start_freight_return()
+        transition(Service, 'start_freight_return', [self.delivery_service_id, self.reception_service_id])
 
     def finish_freight_return(self):
-        self.delivery_service.finish_freight_return()
-        self.reception_service.finish_freight_return()
+        transition(Service, 'finish_freight_return', [self.delivery_service_id, self.reception_service_id])
 
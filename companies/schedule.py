@@ -0,0 +1,57 @@
+from datetime import timedelta
+from itertools import groupby
+
+from companies.models import Service
+
+DEFAULT_SCHEDULE_PERIOD = timedelta(days=7)
+
+
+def split_slots(busy_slots, since, until):
+    """
+    Clip `(start, end)` busy slots sorted by start to the period from `since` until `until` and return them with
+    free slots between them, in one sweep.
+    """
+    busy = []
+    free = []
+    free_since = since
+
+    for start, end in busy_slots:
+        start, end = max(start, since), min(end, until)
+        if start > free_since:
+            free.append((free_since, start))
+        busy.append((start, end))
+        free_since = max(free_since, end)
+
+    if free_since < until:
+        free.append((free_since, until))
+
+    return busy, free
+
+
+def get_schedules(robots, since, until):
+    """
+    Return busy slots of robots booked for services and free slots between them, from `since` until `until`,
+    with one query of services overlapping the period.
+    """
+    services = (Service.objects
+                .with_departure()
+                .filter(robot__in=robots, arrival_datetime__lt=until, departure_datetime__gt=since)
+                .order_by('robot', 'arrival_datetime')
+                .values_list('robot', 'pk', 'arrival_datetime', 'departure_datetime'))
+    services = {robot_id: list(robot_services) for robot_id, robot_services
+                in groupby(services, key=lambda service: service[0])}
+
+    schedules = []
+    for robot in robots:
+        robot_services = services.get(robot.pk, [])
+        busy, free = split_slots([(arrival, departure) for robot_id, service_id, arrival, departure
+                                  in robot_services], since, until)
+
+        schedules.append({
+            'robot': robot.pk,
+            'busy': [{'service': service[1], 'start': start, 'end': end}
+                     for service, (start, end) in zip(robot_services, busy)],
+            'free': [{'start': start, 'end': end} for start, end in free],
+        })
+
+    return schedules
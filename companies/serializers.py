@@ -1,5 +1,11 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
 
+from companies.capacity import DEFAULT_CAPACITY_PERIOD, MAX_CAPACITY_PERIOD
+from companies.matching import DEFAULT_MAX_GAP
+from companies.schedule import DEFAULT_SCHEDULE_PERIOD
 from companies.models import Company, Robot, Service, Transfer
 
 
@@ -19,6 +25,7 @@ class ServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Service
         fields = '__all__'
+        read_only_fields = ['is_scheduled']
 
     def validate(self, attrs):
         robot = attrs.get('robot')
@@ -36,9 +43,65 @@ class ServiceSerializer(serializers.ModelSerializer):
                 and service_status != Service.Status.NOT_STARTED):
             raise serializers.ValidationError('Started service can not be set to busy robot.')
 
+        arrival_datetime = attrs.get('arrival_datetime', self.instance and self.instance.arrival_datetime)
+        duration = attrs.get('duration', self.instance and self.instance.duration)
+
+        if (robot
+                and arrival_datetime
+                and Service.objects.find_conflict(robot, arrival_datetime, duration, exclude=self.instance)):
+            raise serializers.ValidationError('Robot is already booked for another service at this time.')
+
+        return attrs
+
+
+class ServiceDispatchSerializer(serializers.Serializer):
+    robot_type = serializers.ChoiceField(choices=Robot.Type.choices)
+    type = serializers.ChoiceField(choices=Service.Type.choices)
+    arrival_datetime = serializers.DateTimeField()
+    duration = serializers.DurationField(required=False, allow_null=True)
+
+
+class ScheduleFilterSerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        since = attrs.setdefault('since', timezone.now())
+        until = attrs.setdefault('until', since + DEFAULT_SCHEDULE_PERIOD)
+
+        if until <= since:
+            raise serializers.ValidationError('Schedule must end after it starts.')
+
         return attrs
 
 
+class CapacityFilterSerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    @staticmethod
+    def truncate_to_hour(timestamp):
+        return timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    def validate(self, attrs):
+        # Forecast is made for whole hours, which lets forecasts requested within the same hour be cached
+        since = self.truncate_to_hour(attrs.get('since', timezone.now()))
+        until = attrs.get('until', since + DEFAULT_CAPACITY_PERIOD)
+        if self.truncate_to_hour(until) != until:
+            until = self.truncate_to_hour(until) + timedelta(hours=1)
+
+        if until <= since:
+            raise serializers.ValidationError('Forecast must end after it starts.')
+        if until - since > MAX_CAPACITY_PERIOD:
+            raise serializers.ValidationError(f'Forecast can not be longer than {MAX_CAPACITY_PERIOD.days} days.')
+
+        return {'since': since, 'until': until}
+
+
+class ServiceMatchSerializer(serializers.Serializer):
+    max_gap = serializers.DurationField(default=DEFAULT_MAX_GAP)
+
+
 class TransferSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transfer
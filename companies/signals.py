@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from companies.cache import capacity_forecasts
+from companies.models import Robot, Service
+
+
+@receiver([post_save, post_delete], sender=Service)
+@receiver([post_save, post_delete], sender=Robot)
+def invalidate_capacity_forecasts(sender, instance, **kwargs):
+    capacity_forecasts.invalidate()
+    # Forecasts could be loaded again by other threads before the change is committed
+    transaction.on_commit(capacity_forecasts.invalidate)
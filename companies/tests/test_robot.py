@@ -1,3 +1,5 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -7,6 +9,7 @@ from test_data.companies.company import create_company
 from test_data.companies.robot import create_robot
 from companies.models import Robot
 from companies.serializers import RobotSerializer
+from freight_terminal.transitions import TransitionError, transition
 
 
 class CreateNewRobotAPITestCase(APITestCase):
@@ -116,6 +119,34 @@ class UpdateRobotAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class RobotTransitionTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.company = create_company()
+        self.busy_robots = [create_robot(company=self.company, status=Robot.Status.BUSY) for i in range(3)]
+        self.free_robot = create_robot(company=self.company, status=Robot.Status.FREE)
+
+    def test_batch_transition(self):
+        with CaptureQueriesContext(connection) as queries:
+            new_status = transition(Robot, 'finish_transit', [robot.id for robot in self.busy_robots])
+
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(new_status, Robot.Status.FREE)
+        self.assertEqual(Robot.objects.filter(status=Robot.Status.FREE).count(), 4)
+
+    def test_batch_transition_is_all_or_nothing(self):
+        with self.assertRaises(TransitionError):
+            transition(Robot, 'finish_transit', [robot.id for robot in [*self.busy_robots, self.free_robot]])
+
+        self.assertEqual(Robot.objects.filter(status=Robot.Status.BUSY).count(), 3)
+
+    def test_transition(self):
+        robot = self.free_robot
+        robot.start_transit()
+
+        self.assertEqual(robot.status, Robot.Status.BUSY)
+        self.assertEqual(Robot.objects.get(id=robot.id).status, Robot.Status.BUSY)
+
+
 class DeleteRobotAPITestCase(APITestCase):
     def setUp(self) -> None:
         self.company = create_company()
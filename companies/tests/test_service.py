@@ -1,3 +1,10 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
@@ -7,7 +14,10 @@ from test_data import fake
 from test_data.companies.company import create_company
 from test_data.companies.robot import create_robot
 from test_data.companies.service import create_robot_service
-from companies.models import Robot, Service
+from test_data.companies.transfer import create_transfer
+from companies.arrivals import ArrivalScheduler
+from companies.matching import pair_services
+from companies.models import Robot, Service, Transfer
 from companies.serializers import ServiceSerializer
 
 
@@ -78,6 +88,348 @@ class CreateNewServiceAPITestCase(APITestCase):
         self.assertEqual(str(response.data['non_field_errors'][0]), 'Robot is unavailable for a new service.')
 
 
+class DispatchServiceAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.company = create_company()
+        self.free_robots = [create_robot(company=self.company, type=Robot.Type.AIR, status=Robot.Status.FREE)
+                            for i in range(2)]
+        create_robot(company=self.company, type=Robot.Type.AIR, status=Robot.Status.BUSY)
+        create_robot(company=self.company, type=Robot.Type.SEA, status=Robot.Status.FREE)
+        create_robot(type=Robot.Type.AIR, status=Robot.Status.FREE)
+
+        self.dispatch = {
+            'robot_type': Robot.Type.AIR,
+            'type': Service.Type.DELIVERY,
+            'arrival_datetime': fake.future_datetime(tzinfo=timezone.get_current_timezone()),
+        }
+        self.service_dispatch_url = reverse('companies:service-dispatch', kwargs={'company_pk': self.company.pk})
+
+    def test_service_dispatch(self):
+        response = self.client.post(self.service_dispatch_url, self.dispatch, format='json')
+        service = Service.objects.get(id=response.data['id'])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, dict(ServiceSerializer(service).data))
+        self.assertEqual(service.robot, self.free_robots[0])
+        self.assertEqual(service.status, Service.Status.NOT_STARTED)
+        self.assertEqual(Robot.objects.get(id=self.free_robots[0].id).status, Robot.Status.BUSY)
+
+    def test_service_dispatch_takes_every_free_robot_once(self):
+        responses = [self.client.post(self.service_dispatch_url, self.dispatch, format='json') for i in range(3)]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [status.HTTP_201_CREATED, status.HTTP_201_CREATED, status.HTTP_409_CONFLICT])
+        self.assertEqual([response.data['robot'] for response in responses[:2]],
+                         [robot.id for robot in self.free_robots])
+
+    def test_service_dispatch_skips_booked_robots(self):
+        create_robot_service(robot=self.free_robots[0], arrival_datetime=self.dispatch['arrival_datetime'],
+                             duration=timedelta(hours=2))
+        response = self.client.post(self.service_dispatch_url, {**self.dispatch, 'duration': '01:30:00'},
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['robot'], self.free_robots[1].id)
+        self.assertEqual(Service.objects.get(id=response.data['id']).duration, timedelta(hours=1, minutes=30))
+        self.assertEqual(Robot.objects.get(id=self.free_robots[0].id).status, Robot.Status.FREE)
+
+        response = self.client.post(self.service_dispatch_url, self.dispatch, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_invalid_service_dispatch(self):
+        response = self.client.post(self.service_dispatch_url, {**self.dispatch, 'robot_type': 'space'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(SERVICE_DURATION=60)
+class ServiceBookingConflictAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.company = create_company()
+        self.robot = create_robot(company=self.company, status=Robot.Status.BUSY)
+        self.arrival_datetime = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.service = create_robot_service(robot=self.robot, arrival_datetime=self.arrival_datetime,
+                                            duration=timedelta(hours=2), status=Service.Status.NOT_STARTED)
+
+        self.new_service = {
+            'robot': self.robot.id,
+            'status': Service.Status.NOT_STARTED,
+            'type': Service.Type.DELIVERY,
+        }
+        self.service_list_url = reverse('companies:service-list',
+                                        kwargs={'company_pk': self.company.account.id, 'robot_pk': self.robot.id})
+        self.service_detail_url = reverse('companies:service-detail',
+                                          kwargs={'company_pk': self.company.account.id,
+                                                  'robot_pk': self.robot.id,
+                                                  'service_pk': self.service.id})
+
+    def test_overlapping_service_creation(self):
+        for arrival_datetime in [self.arrival_datetime + timedelta(hours=1),
+                                 self.arrival_datetime - timedelta(minutes=30)]:
+            response = self.client.post(self.service_list_url,
+                                        {**self.new_service, 'arrival_datetime': arrival_datetime}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(str(response.data['non_field_errors'][0]),
+                             'Robot is already booked for another service at this time.')
+
+        response = self.client.post(self.service_list_url,
+                                    {**self.new_service, 'arrival_datetime': self.arrival_datetime - timedelta(hours=3),
+                                     'duration': '03:30:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_service_overlapping_booking_hidden_behind_later_one(self):
+        # Bookings which overlap each other, e.g. booked before they were checked
+        create_robot_service(robot=self.robot, arrival_datetime=self.arrival_datetime + timedelta(minutes=30),
+                             duration=timedelta(minutes=10))
+
+        response = self.client.post(self.service_list_url,
+                                    {**self.new_service, 'arrival_datetime': self.arrival_datetime + timedelta(hours=1),
+                                     'duration': '00:30:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Service without its own duration is booked for longer when the default duration is raised
+        service = create_robot_service(robot=self.robot, arrival_datetime=self.arrival_datetime + timedelta(hours=5))
+        create_robot_service(robot=self.robot, arrival_datetime=self.arrival_datetime + timedelta(hours=6),
+                             duration=timedelta(minutes=10))
+        conflict_arrival_datetime = self.arrival_datetime + timedelta(hours=7)
+
+        self.assertIsNone(Service.objects.find_conflict(self.robot, conflict_arrival_datetime))
+        with self.settings(SERVICE_DURATION=180):
+            self.assertEqual(Service.objects.find_conflict(self.robot, conflict_arrival_datetime), service)
+
+    def test_adjacent_service_creation(self):
+        responses = [self.client.post(self.service_list_url,
+                                      {**self.new_service, 'arrival_datetime': arrival_datetime}, format='json')
+                     for arrival_datetime in [self.arrival_datetime + timedelta(hours=2),
+                                              self.arrival_datetime - timedelta(hours=1)]]
+
+        self.assertEqual([response.status_code for response in responses],
+                         [status.HTTP_201_CREATED, status.HTTP_201_CREATED])
+        self.assertEqual(Service.objects.filter(robot=self.robot).count(), 3)
+
+    def test_service_rescheduling(self):
+        response = self.client.patch(self.service_detail_url,
+                                     {'arrival_datetime': self.arrival_datetime + timedelta(hours=1)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        create_robot_service(robot=self.robot, arrival_datetime=self.arrival_datetime + timedelta(hours=4))
+        response = self.client.patch(self.service_detail_url, {'duration': '04:00:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ScheduleAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.company = create_company()
+        self.robot = create_robot(company=self.company)
+        self.other_robot = create_robot(company=self.company)
+        self.since = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.services = [create_robot_service(robot=self.robot, arrival_datetime=self.since + timedelta(hours=hours),
+                                              duration=timedelta(hours=1))
+                         for hours in [-0.5, 2, 3]]
+
+        self.filters = {'since': self.since.isoformat(), 'until': (self.since + timedelta(hours=5)).isoformat()}
+        self.robot_schedule_url = reverse('companies:robot-schedule',
+                                          kwargs={'company_pk': self.company.account.id, 'robot_pk': self.robot.id})
+        self.company_schedule_url = reverse('companies:schedule', kwargs={'pk': self.company.account.id})
+
+    def test_robot_schedule(self):
+        response = self.client.get(self.robot_schedule_url, self.filters)
+        hour = timedelta(hours=1)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['busy'], [
+            {'service': self.services[0].id, 'start': self.since, 'end': self.since + hour / 2},
+            {'service': self.services[1].id, 'start': self.since + 2 * hour, 'end': self.since + 3 * hour},
+            {'service': self.services[2].id, 'start': self.since + 3 * hour, 'end': self.since + 4 * hour},
+        ])
+        self.assertEqual(response.data['free'], [
+            {'start': self.since + hour / 2, 'end': self.since + 2 * hour},
+            {'start': self.since + 4 * hour, 'end': self.since + 5 * hour},
+        ])
+
+    def test_company_schedule(self):
+        response = self.client.get(self.company_schedule_url, self.filters)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([schedule['robot'] for schedule in response.data], [self.robot.id, self.other_robot.id])
+        self.assertEqual(len(response.data[0]['busy']), 3)
+        self.assertEqual(response.data[1], {
+            'robot': self.other_robot.id,
+            'busy': [],
+            'free': [{'start': self.since, 'end': self.since + timedelta(hours=5)}],
+        })
+
+    def test_invalid_schedule_period(self):
+        response = self.client.get(self.robot_schedule_url, {'since': self.filters['until'],
+                                                             'until': self.filters['since']})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(SERVICE_DURATION=60)
+class CompanyCapacityAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.company = create_company()
+        self.air_robots = [create_robot(company=self.company, type=Robot.Type.AIR, status=Robot.Status.BUSY)
+                           for i in range(2)]
+        create_robot(company=self.company, type=Robot.Type.AIR, status=Robot.Status.UNAVAILABLE)
+        self.sea_robot = create_robot(company=self.company, type=Robot.Type.SEA, status=Robot.Status.BUSY)
+
+        self.since = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        for robot, minutes, duration in [(self.air_robots[0], 30, timedelta(hours=2)),
+                                         (self.air_robots[0], 150, timedelta(minutes=30)),
+                                         (self.air_robots[1], -30, None),
+                                         (self.sea_robot, 60, None)]:
+            create_robot_service(robot=robot, arrival_datetime=self.since + timedelta(minutes=minutes),
+                                 duration=duration)
+
+        self.filters = {'since': self.since.isoformat(), 'until': (self.since + timedelta(hours=4)).isoformat()}
+        self.capacity_url = reverse('companies:capacity', kwargs={'pk': self.company.account.id})
+
+    def get_histograms(self, response):
+        return {robot_type['robot_type']: (robot_type['fleet_size'],
+                                           [hour['arrivals'] for hour in robot_type['hours']],
+                                           [hour['busy_robots'] for hour in robot_type['hours']],
+                                           [hour['free_robots'] for hour in robot_type['hours']])
+                for robot_type in response.data['robot_types']}
+
+    def test_company_capacity(self):
+        response = self.client.get(self.capacity_url, self.filters)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['robot_types'][0]['hours'][1]['hour'], self.since + timedelta(hours=1))
+        self.assertEqual(self.get_histograms(response), {
+            Robot.Type.AIR: (2, [1, 0, 1, 0], [2, 1, 1, 0], [0, 1, 1, 2]),
+            Robot.Type.SEA: (1, [0, 1, 0, 0], [0, 1, 0, 0], [1, 0, 1, 1]),
+            Robot.Type.LAND: (0, [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]),
+        })
+
+    def test_company_capacity_is_cached_until_services_change(self):
+        self.client.get(self.capacity_url, self.filters)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.capacity_url, self.filters)
+        self.assertFalse(any('companies_service' in query['sql'] for query in queries.captured_queries))
+
+        create_robot_service(robot=self.sea_robot, arrival_datetime=self.since + timedelta(hours=3))
+        response = self.client.get(self.capacity_url, self.filters)
+        self.assertEqual(self.get_histograms(response)[Robot.Type.SEA][1], [0, 1, 0, 1])
+
+    def test_invalid_capacity_period(self):
+        response = self.client.get(self.capacity_url, {'since': self.filters['since'],
+                                                       'until': (self.since + timedelta(days=32)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ArrivalSchedulerTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.robot = create_robot()
+        self.now = timezone.now()
+        self.due_service = create_robot_service(robot=self.robot, arrival_datetime=self.now - timedelta(minutes=1),
+                                                status=Service.Status.NOT_STARTED)
+        self.upcoming_service = create_robot_service(robot=self.robot, arrival_datetime=self.now + timedelta(hours=1),
+                                                     status=Service.Status.NOT_STARTED)
+        self.started_service = create_robot_service(robot=self.robot, arrival_datetime=self.now - timedelta(hours=1),
+                                                    status=Service.Status.DONE)
+
+        self.scheduler = ArrivalScheduler()
+        self.scheduler.load()
+        self.scheduler.refresh()
+
+    def get_status(self, service):
+        return Service.objects.get(pk=service.pk).status
+
+    def test_due_services_arrive(self):
+        self.assertEqual(self.scheduler.fire_due(self.now), [self.due_service.id])
+        self.assertEqual(self.get_status(self.due_service), Service.Status.WAITING)
+        self.assertEqual(self.get_status(self.upcoming_service), Service.Status.NOT_STARTED)
+        self.assertEqual(self.get_status(self.started_service), Service.Status.DONE)
+
+        self.assertEqual(self.scheduler.fire_due(self.now + timedelta(hours=2)), [self.upcoming_service.id])
+        self.assertEqual(self.scheduler.get_timeout(5), 5)
+
+    def test_rescheduled_services_arrive_at_new_time(self):
+        self.due_service.arrival_datetime = self.now + timedelta(hours=2)
+        self.due_service.save()
+        self.upcoming_service.arrival_datetime = self.now - timedelta(minutes=2)
+        self.upcoming_service.save()
+
+        self.assertEqual(self.scheduler.refresh(), 2)
+        self.assertEqual(self.scheduler.fire_due(self.now), [self.upcoming_service.id])
+        self.assertEqual(self.get_status(self.due_service), Service.Status.NOT_STARTED)
+        self.assertEqual(self.scheduler.get_timeout(3 * 3600, self.now), 2 * 3600)
+
+    def test_rescheduled_service_is_not_moved_before_it_is_taken(self):
+        Service.objects.filter(pk=self.due_service.pk).update(arrival_datetime=self.now + timedelta(hours=2))
+
+        self.assertEqual(self.scheduler.fire_due(self.now), [])
+        self.assertEqual(self.get_status(self.due_service), Service.Status.NOT_STARTED)
+
+    def test_new_services_are_taken_without_reload(self):
+        service = create_robot_service(robot=self.robot, arrival_datetime=self.now - timedelta(seconds=1),
+                                       status=Service.Status.NOT_STARTED)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.scheduler.refresh(), 1)
+        self.assertFalse(any('"status" = ' in query['sql'] for query in queries.captured_queries))
+
+        self.assertEqual(self.scheduler.fire_due(self.now), [self.due_service.id, service.id])
+
+    def test_schedule_service_arrivals_command(self):
+        stdout = StringIO()
+        call_command('schedule_service_arrivals', once=True, stdout=stdout)
+
+        self.assertIn('1 services arrived', stdout.getvalue())
+        self.assertEqual(self.get_status(self.due_service), Service.Status.WAITING)
+
+
+class MatchServicesAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.now = timezone.now()
+        sea_robot = create_robot(type=Robot.Type.SEA)
+        land_robot = create_robot(type=Robot.Type.LAND)
+        air_robot = create_robot(type=Robot.Type.AIR)
+
+        def create_service(robot, service_type, minutes, service_status=Service.Status.NOT_STARTED):
+            return create_robot_service(robot=robot, type=service_type, status=service_status,
+                                        arrival_datetime=self.now + timedelta(minutes=minutes))
+
+        self.deliveries = [create_service(sea_robot, Service.Type.DELIVERY, minutes) for minutes in [0, 60]]
+        self.receptions = [create_service(land_robot, Service.Type.RECEPTION, minutes) for minutes in [30, 120]]
+        self.air_reception = create_service(air_robot, Service.Type.RECEPTION, 45)
+        create_service(sea_robot, Service.Type.DELIVERY, 10, Service.Status.DONE)
+        create_transfer(delivery_service=create_service(sea_robot, Service.Type.DELIVERY, 20),
+                        reception_service=create_service(land_robot, Service.Type.RECEPTION, 40))
+
+        self.service_match_url = reverse('companies:service-match')
+
+    def test_service_match(self):
+        response = self.client.post(self.service_match_url, {}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['transfers'], [
+            {'delivery_service': self.deliveries[0].id, 'reception_service': self.receptions[0].id},
+            {'delivery_service': self.deliveries[1].id, 'reception_service': self.receptions[1].id},
+        ])
+        self.assertEqual(response.data['unpaired_services'], [self.air_reception.id])
+        self.assertEqual(Transfer.objects.count(), 3)
+
+    def test_service_match_with_max_gap(self):
+        response = self.client.post(self.service_match_url, {'max_gap': '00:20:00'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['transfers'], [])
+        self.assertEqual(Transfer.objects.count(), 1)
+
+    def test_reception_takes_latest_delivery(self):
+        deliveries = [(1, Robot.Type.AIR, self.now), (2, Robot.Type.LAND, self.now + timedelta(minutes=5)),
+                      (3, Robot.Type.AIR, self.now + timedelta(minutes=10))]
+        receptions = [(4, Robot.Type.AIR, self.now + timedelta(minutes=10)),
+                      (5, Robot.Type.AIR, self.now + timedelta(minutes=15)),
+                      (6, Robot.Type.SEA, self.now + timedelta(minutes=20))]
+
+        self.assertEqual(pair_services(deliveries, receptions, timedelta(hours=1)), [(3, 4), (2, 5)])
+
+
 class GetServiceAPITestCase(APITestCase):
     def setUp(self) -> None:
         self.company = create_company()
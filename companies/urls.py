@@ -7,10 +7,16 @@ app_name = 'companies'
 urlpatterns = [
     path('', views.CompanyListCreateAPIView.as_view(), name='list'),
     path('types/', views.GetCompanyTypesAPIVIew.as_view(), name='types'),
+    path('services/match/', views.ServiceMatchAPIView.as_view(), name='service-match'),
     path('<int:pk>/', views.CompanyRetrieveUpdateDestroyAPIView.as_view(), name='detail'),
     path('<int:pk>/robots/', views.RobotListCreateAPIView.as_view(), name='robot-list'),
+    path('<int:pk>/schedule/', views.CompanyScheduleAPIView.as_view(), name='schedule'),
+    path('<int:pk>/capacity/', views.CompanyCapacityAPIView.as_view(), name='capacity'),
+    path('<int:company_pk>/services/dispatch/', views.ServiceDispatchAPIView.as_view(), name='service-dispatch'),
     path('<int:company_pk>/robots/<int:robot_pk>/', views.RobotRetrieveUpdateDestroyAPIView.as_view(),
          name='robot-detail'),
+    path('<int:company_pk>/robots/<int:robot_pk>/schedule/', views.RobotScheduleAPIView.as_view(),
+         name='robot-schedule'),
     path('<int:company_pk>/robots/<int:robot_pk>/services/', views.ServiceListCreateAPIView.as_view(),
          name='service-list'),
     path('<int:company_pk>/robots/<int:robot_pk>/services/<int:service_pk>/',
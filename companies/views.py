@@ -1,8 +1,14 @@
-from rest_framework import generics, views
+from django.db import transaction
+from rest_framework import generics, status, views
 from rest_framework.response import Response
 
+from companies.cache import capacity_forecasts
 from companies.models import Company, Robot, Service
-from companies.serializers import CompanySerializer, RobotSerializer, ServiceSerializer
+from companies.matching import match_services
+from companies.schedule import get_schedules
+from companies.serializers import (CapacityFilterSerializer, CompanySerializer, RobotSerializer,
+                                   ScheduleFilterSerializer, ServiceDispatchSerializer, ServiceMatchSerializer,
+                                   ServiceSerializer)
 
 
 class GetCompanyTypesAPIVIew(views.APIView):
@@ -38,6 +44,36 @@ class RobotRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         return generics.get_object_or_404(Robot, pk=self.kwargs['robot_pk'], company=company)
 
 
+class CompanyScheduleAPIView(views.APIView):
+    def get(self, request, pk=None):
+        company = generics.get_object_or_404(Company, pk=pk)
+        filter_serializer = ScheduleFilterSerializer(data=request.query_params)
+        filter_serializer.is_valid(raise_exception=True)
+
+        robots = list(Robot.objects.filter(company=company).order_by('pk'))
+        return Response(get_schedules(robots, **filter_serializer.validated_data))
+
+
+class CompanyCapacityAPIView(views.APIView):
+    def get(self, request, pk=None):
+        company = generics.get_object_or_404(Company, pk=pk)
+        filter_serializer = CapacityFilterSerializer(data=request.query_params)
+        filter_serializer.is_valid(raise_exception=True)
+
+        filters = filter_serializer.validated_data
+        return Response(capacity_forecasts.get((company.pk, filters['since'], filters['until'])))
+
+
+class RobotScheduleAPIView(views.APIView):
+    def get(self, request, company_pk=None, robot_pk=None):
+        company = generics.get_object_or_404(Company, pk=company_pk)
+        robot = generics.get_object_or_404(Robot, pk=robot_pk, company=company)
+        filter_serializer = ScheduleFilterSerializer(data=request.query_params)
+        filter_serializer.is_valid(raise_exception=True)
+
+        return Response(get_schedules([robot], **filter_serializer.validated_data)[0])
+
+
 class ServiceListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = ServiceSerializer
 
@@ -46,10 +82,45 @@ class ServiceListCreateAPIView(generics.ListCreateAPIView):
         robot = generics.get_object_or_404(Robot, pk=self.kwargs['robot_pk'], company=company)
         return Service.objects.filter(robot=robot)
 
+    def create(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        service = serializer.save()
-        service.robot.start_transit()
-        service.robot.save()
+        # Robot is validated again with its row locked, so concurrent requests can not both see it free
+        # or book it for overlapping periods
+        robot = Robot.objects.select_for_update().get(pk=serializer.validated_data['robot'].pk)
+        serializer.validated_data['robot'] = robot
+        serializer.validate(serializer.validated_data)
+
+        serializer.save()
+        robot.start_transit()
+
+
+class ServiceDispatchAPIView(views.APIView):
+    def post(self, request, company_pk=None):
+        company = generics.get_object_or_404(Company, pk=company_pk)
+        serializer = ServiceDispatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        service = Service.objects.dispatch(company, **serializer.validated_data)
+        if not service:
+            return Response(data={'detail': 'There is no free robot of this type'}, status=status.HTTP_409_CONFLICT)
+
+        return Response(ServiceSerializer(service).data, status=status.HTTP_201_CREATED)
+
+
+class ServiceMatchAPIView(views.APIView):
+    def post(self, request):
+        serializer = ServiceMatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        pairs, unpaired = match_services(**serializer.validated_data)
+
+        transfers = [{'delivery_service': delivery_id, 'reception_service': reception_id}
+                     for delivery_id, reception_id in pairs]
+        return Response(data={'transfers': transfers, 'unpaired_services': unpaired},
+                        status=status.HTTP_201_CREATED)
 
 
 class ServiceRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
@@ -60,3 +131,15 @@ class ServiceRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
         company = generics.get_object_or_404(Company, pk=self.kwargs['company_pk'])
         robot = generics.get_object_or_404(Robot, pk=self.kwargs['robot_pk'], company=company)
         return generics.get_object_or_404(Service, pk=self.kwargs['service_pk'], robot=robot)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        # Robot is validated again with its row locked, so concurrent requests can not book it for overlapping periods
+        robot = serializer.validated_data.get('robot', serializer.instance.robot)
+        serializer.validated_data['robot'] = Robot.objects.select_for_update().get(pk=robot.pk)
+        serializer.validate(serializer.validated_data)
+
+        serializer.save()
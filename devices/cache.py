@@ -0,0 +1,18 @@
+from collections import namedtuple
+
+from django.conf import settings
+
+from devices.models import Device
+from freight_terminal.cache import LRUCache
+
+DeviceBounds = namedtuple('DeviceBounds', ['min_value', 'max_value'])
+
+
+def _load_device_bounds(device_id):
+    bounds = Device.objects.filter(pk=device_id).values_list('min_value', 'max_value').first()
+    return DeviceBounds(*bounds) if bounds else None
+
+
+# Min and max values of devices by their ids, invalidated by signals when a device is saved or deleted
+device_bounds = LRUCache(_load_device_bounds, max_size=settings.DEVICE_BOUNDS_CACHE_SIZE,
+                         ttl=settings.DEVICE_BOUNDS_CACHE_TTL)
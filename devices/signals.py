@@ -0,0 +1,15 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from devices.cache import device_bounds
+from devices.models import Device
+
+
+@receiver([post_save, post_delete], sender=Device)
+def invalidate_device_bounds(sender, instance, **kwargs):
+    device_bounds.invalidate(instance.pk)
+    # Bounds could be loaded again by other threads before the change is committed
+    transaction.on_commit(partial(device_bounds.invalidate, instance.pk))
@@ -6,8 +6,10 @@ from rest_framework.test import APITestCase
 
 from test_data import fake
 from test_data.devices.device import create_device
+from devices.cache import DeviceBounds, device_bounds
 from devices.models import Device
 from devices.serializers import DeviceSerializer
+from freight_terminal.cache import LRUCache
 
 
 class CreateNewDeviceAPITestCase(APITestCase):
@@ -107,4 +109,44 @@ class UpdateDeviceAPITestCase(APITestCase):
 
 
 class DeleteDeviceAPITestCase(APITestCase):
-    ...
\ No newline at end of file
+    ...
+
+
+class DeviceBoundsCacheTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.device = create_device()
+        device_bounds.invalidate()
+
+    def test_bounds_are_cached(self):
+        with self.assertNumQueries(1):
+            device_bounds.get(self.device.id)
+            bounds = device_bounds.get(self.device.id)
+
+        self.assertEqual(bounds, DeviceBounds(self.device.min_value, self.device.max_value))
+
+    def test_bounds_are_invalidated_on_save(self):
+        device_bounds.get(self.device.id)
+        self.device.max_value += 1
+        self.device.save()
+
+        self.assertEqual(device_bounds.get(self.device.id).max_value, self.device.max_value)
+
+    def test_bounds_are_invalidated_on_delete(self):
+        device_id = self.device.id
+        device_bounds.get(device_id)
+        self.device.delete()
+
+        self.assertIsNone(device_bounds.get(device_id))
+
+    def test_least_recently_used_bounds_are_evicted(self):
+        devices = [create_device() for i in range(3)]
+        cache = LRUCache(device_bounds.load, max_size=2, ttl=60)
+
+        for device in devices:
+            cache.get(device.id)
+        cache.get(devices[1].id)
+        cache.get(devices[0].id)
+
+        with self.assertNumQueries(0):
+            cache.get(devices[0].id)
+            cache.get(devices[1].id)
@@ -9,8 +9,20 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'freight_terminal.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Imported after Django is set up, as they use the ORM
+from freight_terminal.async_api import StreamingASGIHandler  # noqa: E402
+from freight_terminal.event_stream import EVENTS_PATH, event_stream  # noqa: E402
+
+django_application = StreamingASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await event_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+_orm_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_ORM_MAX_THREADS, thread_name_prefix='orm')
+
+
+def _call_with_connection(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_orm_thread(func, *args, **kwargs):
+    """
+    Run blocking ORM work in the bounded pool of threads, each of which keeps its own database connection.
+
+    Number of concurrent requests is not limited by the pool, only number of concurrent database operations is.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_orm_executor, partial(_call_with_connection, func, *args, **kwargs))
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGI handler which iterates streaming responses in the thread running synchronous views.
+
+    Django 3.2 iterates them in the event loop, where the ORM can not be used, so streaming responses which read
+    from the database would fail after their headers are sent. Every part is taken in the thread, one at a time,
+    so the database connection used by the response iterator stays in one thread.
+    """
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        response_headers = [(header.encode('ascii') if isinstance(header, str) else header,
+                             value.encode('latin1') if isinstance(value, str) else value)
+                            for header, value in response.items()]
+        for cookie in response.cookies.values():
+            response_headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        end = object()
+
+        while True:
+            part = await next_part(parts, end)
+            if part is end:
+                break
+            for chunk, last in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def authenticate(request):
+    """
+    Authenticate the request and check its permissions with the classes configured for REST framework.
+    """
+    request.user, request.auth = AnonymousUser(), None
+
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        user_auth = authentication_class().authenticate(request)
+        if user_auth:
+            request.user, request.auth = user_auth
+            break
+
+    for permission_class in api_settings.DEFAULT_PERMISSION_CLASSES:
+        if not permission_class().has_permission(request, None):
+            if not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied()
+
+
+def parse_json(request):
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        raise exceptions.ParseError()
+
+
+def async_api_view(methods):
+    """
+    Turn a coroutine into a view which is authenticated and permitted the same way as REST framework views.
+
+    REST framework views are synchronous, so they occupy a worker thread for the whole request. These views only
+    wait for results of `run_in_orm_thread`. REST framework exceptions are rendered as JSON responses.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapped_view(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+
+            try:
+                await run_in_orm_thread(authenticate, request)
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+
+        # csrf_exempt decorator does not support coroutines yet
+        wrapped_view.csrf_exempt = True
+        return wrapped_view
+
+    return decorator
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache of values returned by `load(key)`, with at most `max_size` entries.
+
+    Entries are dropped by `invalidate` and when they are older than `ttl` seconds, which bounds staleness of
+    values changed by other processes. Every invalidation bumps the version of the cache, so a value which was
+    being loaded while it was invalidated is returned but not stored. Missing values (None) are not cached.
+    """
+    def __init__(self, load, max_size, ttl):
+        self.load = load
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            version = self.version
+
+        value = self.load(key)
+
+        if value is not None:
+            with self._lock:
+                if self.version == version:
+                    self._entries[key] = (now + self.ttl, value)
+                    self._entries.move_to_end(key)
+                    if len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Drop the entry with the key, or all entries if the key is not given.
+        """
+        with self._lock:
+            self.version += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
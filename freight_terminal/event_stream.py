@@ -0,0 +1,85 @@
+import asyncio
+import io
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework import exceptions
+
+from freight_terminal.async_api import authenticate, run_in_orm_thread
+from freight_terminal.events import broadcaster
+
+EVENTS_PATH = '/events/'
+HEARTBEAT_INTERVAL = 15
+
+
+def _format_event(event):
+    return f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+async def _send_response_start(send, request, status, content_type):
+    headers = [(b'content-type', content_type), (b'cache-control', b'no-cache')]
+
+    origin = request.META.get('HTTP_ORIGIN')
+    if origin in settings.CORS_ALLOWED_ORIGINS:
+        headers.append((b'access-control-allow-origin', origin.encode()))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def event_stream(scope, receive, send):
+    """
+    ASGI application which streams changes of freights, robots and services as Server-Sent Events.
+
+    Events can be limited to some of the types with `types` query parameter. Browsers can not set headers of
+    event source requests, so the access token can be passed with `token` query parameter as well.
+
+    Django 3.2 iterates streaming responses synchronously, which would block the event loop, so the stream is
+    served outside of Django request handling.
+    """
+    request = ASGIRequest(scope, io.BytesIO())
+    token = request.GET.get('token')
+    if token and 'HTTP_AUTHORIZATION' not in request.META:
+        request.META['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+    try:
+        await run_in_orm_thread(authenticate, request)
+    except exceptions.APIException as exc:
+        await _send_response_start(send, request, exc.status_code, b'application/json')
+        await send({'type': 'http.response.body', 'body': json.dumps({'detail': exc.detail}).encode()})
+        return
+
+    types = set(request.GET['types'].split(',')) if request.GET.get('types') else None
+    queue = broadcaster.subscribe()
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+
+    try:
+        await _send_response_start(send, request, 200, b'text/event-stream')
+
+        while True:
+            next_event = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait([next_event, disconnect], timeout=HEARTBEAT_INTERVAL,
+                                               return_when=asyncio.FIRST_COMPLETED)
+
+            if disconnect in done:
+                next_event.cancel()
+                break
+
+            if next_event in done:
+                event = next_event.result()
+                if types and event['type'] not in types:
+                    continue
+                body = _format_event(event)
+            else:
+                next_event.cancel()
+                body = b': heartbeat\n\n'
+
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnect.cancel()
+        broadcaster.unsubscribe(queue)
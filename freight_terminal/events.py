@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from functools import partial
+
+from django.db import transaction
+
+EVENT_QUEUE_SIZE = 1000
+
+
+class Broadcaster:
+    """
+    Fan out events published from any thread of the process to subscribers waiting in its event loops.
+
+    Every subscriber has a bounded queue, when a slow subscriber does not keep up its oldest events are dropped.
+    """
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, event)
+            except RuntimeError:
+                # Event loop of the subscriber is closed
+                self.unsubscribe(queue)
+
+    @staticmethod
+    def _put(queue, event):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+broadcaster = Broadcaster()
+
+
+def publish_changes(model, pk, changes):
+    """
+    Publish changes of the object to subscribers when the current transaction is committed.
+    """
+    event = {'type': model._meta.model_name, 'id': pk, 'changes': changes}
+    transaction.on_commit(partial(broadcaster.publish, event))
+
+
+class BroadcastChangesMixin:
+    """
+    Publish changes of `broadcast_fields` of the model whenever an object is saved with them changed.
+
+    Changes done with `QuerySet.update()` are not tracked and must be published with `publish_changes`.
+    """
+    broadcast_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._broadcast_values = instance._get_broadcast_values()
+        return instance
+
+    def _get_broadcast_values(self):
+        return {field: self.__dict__[field] for field in self.broadcast_fields if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        values = self._get_broadcast_values()
+        previous_values = getattr(self, '_broadcast_values', {})
+        changes = {field: value for field, value in values.items()
+                   if field not in previous_values or previous_values[field] != value}
+
+        if changes:
+            publish_changes(type(self), self.pk, changes)
+        self._broadcast_values = values
@@ -0,0 +1,36 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from whitenoise import middleware
+
+
+class WhiteNoiseMiddleware(middleware.WhiteNoiseMiddleware):
+    """
+    WhiteNoise middleware which can be run by the ASGI handler without leaving the event loop.
+
+    Django runs the whole middleware chain of a request in the thread of synchronous code if any middleware is
+    synchronous only, so with the original one every request, async views included, would be run one at a time.
+    Static files are looked up and served in a thread, other requests go straight to the next handler.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Marks the instance as a coroutine function for the handler, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh or request.path_info in self.files:
+            response = await sync_to_async(self.process_request, thread_sensitive=False)(request)
+            if response is not None:
+                return response
+
+        return await self.get_response(request)
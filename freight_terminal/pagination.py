@@ -0,0 +1,106 @@
+import json
+
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Cursor pagination which orders by `ordering` attribute of the view if it is set.
+
+    Position of the cursor holds values of all ordering fields rather than of the first one, so items which share
+    the first value are paged by the next fields instead of an offset. Ordering must be on indexed columns and
+    end with a unique one, so any page costs the same as the first one.
+    """
+    ordering = 'pk'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', None) or self.ordering
+
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        ordering = pagination._reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(ordering, current_position))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+
+        has_following_position = len(results) > len(self.page)
+        following_position = None
+        if has_following_position:
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    @staticmethod
+    def _get_keyset_filter(ordering, position):
+        """
+        Return filter of items after the position in the ordering, e.g. `a > x OR (a = x AND b > y)`.
+
+        The first field is also bounded on its own, so the index scan starts at the position.
+        """
+        fields = [order.lstrip('-') for order in ordering]
+        keyset_filter = Q()
+
+        for index, order in enumerate(ordering):
+            lookup = 'lt' if order.startswith('-') else 'gt'
+            keyset_filter |= Q(**dict(zip(fields[:index], position[:index])),
+                               **{f'{fields[index]}__{lookup}': position[index]})
+
+        first_lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{fields[0]}__{first_lookup}': position[0]}) & keyset_filter
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if (not isinstance(position, list) or len(position) != len(self.ordering) or
+                not all(isinstance(value, str) for value in position)):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def encode_cursor(self, cursor):
+        if cursor.position is not None:
+            cursor = cursor._replace(position=json.dumps(cursor.position))
+        return super().encode_cursor(cursor)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return [str(instance[field] if isinstance(instance, dict) else getattr(instance, field))
+                for field in (order.lstrip('-') for order in ordering)]
@@ -31,7 +31,9 @@ REST_FRAMEWORK = {
 
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+
+    'DEFAULT_PAGINATION_CLASS': 'freight_terminal.pagination.CursorPagination',
 }
 
 SIMPLE_JWT = {
@@ -92,6 +94,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'freight_terminal.wsgi.application'
 
+# Maximum number of threads (and so database connections) running ORM work of async views in one process
+ASYNC_ORM_MAX_THREADS = env.int('ASYNC_ORM_MAX_THREADS', default=16)
+
 
 # Authentication
 
@@ -105,6 +110,44 @@ DATABASE_BACKUP_FILENAME = 'db_backup.json'
 
 DATABASES = {'default': env.db('DATABASE_URL')}
 
+# Opt-in monthly partitioning of freight states table by timestamp, works only with PostgreSQL.
+# It is applied by freights migrations, so it must be set before they are run
+STATE_PARTITIONING = env.bool('STATE_PARTITIONING', default=False)
+
+# Smoothing factor of exponentially weighted moving statistics of rule states, and weight of anomaly score based on
+# them in freight damage level, where the rest of the weight is left to the share of out of limit states
+ANOMALY_EWMA_ALPHA = env.float('ANOMALY_EWMA_ALPHA', default=0.1)
+ANOMALY_SCORE_WEIGHT = env.float('ANOMALY_SCORE_WEIGHT', default=0)
+
+# Opt-in write-behind mode in which new states are buffered in each process and written in bulk every
+# STATE_WRITE_BEHIND_INTERVAL milliseconds or as soon as STATE_WRITE_BEHIND_MAX_ROWS states are buffered.
+# With STATE_WRITE_BEHIND_ACK set to "buffer" requests are answered before states are written, so states
+# buffered by a process which is killed are lost, with "flush" they are answered after states are written.
+# Synchronous views are run one at a time, so with "flush" only the async ingestion endpoint buffers states
+STATE_WRITE_BEHIND = env.bool('STATE_WRITE_BEHIND', default=False)
+STATE_WRITE_BEHIND_INTERVAL = env.int('STATE_WRITE_BEHIND_INTERVAL', default=200)
+STATE_WRITE_BEHIND_MAX_ROWS = env.int('STATE_WRITE_BEHIND_MAX_ROWS', default=5000)
+STATE_WRITE_BEHIND_ACK = env.str('STATE_WRITE_BEHIND_ACK', default='flush')
+
+# Maximum number of devices which bounds are cached in memory of each process and for how many seconds.
+# Changes done by other processes are seen by the process after this number of seconds at most
+DEVICE_BOUNDS_CACHE_SIZE = env.int('DEVICE_BOUNDS_CACHE_SIZE', default=10000)
+DEVICE_BOUNDS_CACHE_TTL = env.int('DEVICE_BOUNDS_CACHE_TTL', default=60)
+
+# Minutes for which a robot is booked from arrival of a service which is created without its own duration.
+# Services of a robot can not be booked for overlapping periods. The default is applied when bookings are read,
+# so raising it lengthens existing services without their own duration and can make them overlap, which new
+# bookings are still checked against
+SERVICE_DURATION = env.int('SERVICE_DURATION', default=60)
+
+# Maximum number of capacity forecasts cached in memory of each process and for how many seconds.
+# Forecasts are dropped when services or robots are changed by the process
+CAPACITY_CACHE_SIZE = env.int('CAPACITY_CACHE_SIZE', default=1000)
+CAPACITY_CACHE_TTL = env.int('CAPACITY_CACHE_TTL', default=60)
+
+# Number of months for which freight states are kept when partitioning is on, they are kept forever if not set
+STATE_RETENTION_MONTHS = env.int('STATE_RETENTION_MONTHS', default=None)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -146,3 +189,7 @@ STATIC_URL = '/static/'
 
 # Heroku
 django_heroku.settings(locals())
+
+# WhiteNoise middleware added by django-heroku is replaced with one which does not make ASGI requests run
+# one at a time
+MIDDLEWARE = [middleware.replace('whitenoise.middleware.', 'freight_terminal.middleware.') for middleware in MIDDLEWARE]
@@ -0,0 +1,37 @@
+from collections import namedtuple
+
+from django.db import transaction
+
+from freight_terminal.events import publish_changes
+
+Transition = namedtuple('Transition', ['sources', 'target'])
+
+
+class TransitionError(Exception):
+    """
+    Raised when some of the objects are not in a status the transition can be taken from.
+    """
+
+
+def transition(model, name, pks, **guards):
+    """
+    Move objects of the model with given ids along transition `name` of `model.TRANSITIONS` with a single UPDATE
+    guarded by their current status and by lookups given as `guards`, which changes nothing but the status.
+    Returns the new status.
+
+    Either all of the objects are moved or none of them and TransitionError is raised, so a status changed
+    concurrently is never overwritten. Transitions of several models are taken atomically within one transaction.
+    """
+    sources, target = model.TRANSITIONS[name]
+    pks = set(pks)
+
+    with transaction.atomic():
+        moved = model.objects.filter(pk__in=pks, status__in=sources, **guards).update(status=target)
+        if moved != len(pks):
+            raise TransitionError(f'{model._meta.verbose_name_plural.capitalize()} can not {name.replace("_", " ")} '
+                                  f'from their current status')
+
+        for pk in pks:
+            publish_changes(model, pk, {'status': target})
+
+    return target
@@ -1,8 +1,21 @@
 from django.contrib import admin
 
-from freights.models import Freight, Rule, State
+from freights.models import Freight, FreightHealth, Rule, State, StateRollup
+
+
+class RuleAdmin(admin.ModelAdmin):
+    readonly_fields = [*Rule.COUNTER_FIELDS, *Rule.STREAMING_STATS_FIELDS]
+
+    def save_model(self, request, obj, form, change):
+        # Only changed fields are written, so counters and statistics changed by concurrent ingestion are kept
+        if change:
+            obj.save(update_fields=form.changed_data)
+        else:
+            super().save_model(request, obj, form, change)
 
 
 admin.site.register(Freight)
-admin.site.register(Rule)
-admin.site.register(State)
\ No newline at end of file
+admin.site.register(FreightHealth)
+admin.site.register(Rule, RuleAdmin)
+admin.site.register(State)
+admin.site.register(StateRollup)
@@ -0,0 +1,31 @@
+from django.http import JsonResponse
+from rest_framework import exceptions
+
+from freight_terminal.async_api import async_api_view, parse_json, run_in_orm_thread
+from freights.ingestion import get_batch_error, store_states_async, validate_readings
+from freights.models import Freight
+from freights.views import get_created_status
+
+
+@async_api_view(['POST'])
+async def state_bulk_create(request):
+    readings = parse_json(request)
+
+    batch_error = get_batch_error(readings)
+    if batch_error:
+        raise exceptions.ParseError(batch_error)
+
+    states, errors = await run_in_orm_thread(validate_readings, readings)
+    await store_states_async(states)
+
+    return JsonResponse({'created': len(states), 'errors': errors}, status=get_created_status())
+
+
+@async_api_view(['GET'])
+async def freight_health(request, pk):
+    is_damaged = await run_in_orm_thread(Freight.objects.filter(pk=pk).values_list('is_damaged', flat=True).first)
+
+    if is_damaged is None:
+        raise exceptions.NotFound()
+
+    return JsonResponse({'is_damaged': is_damaged})
@@ -0,0 +1,48 @@
+import struct
+from datetime import timedelta
+
+from freights.ingestion import EPOCH
+
+FRAME_MAGIC = b'FTS1'
+RECORD = struct.Struct('<qqd')
+
+
+def _to_microseconds(timestamp):
+    if timestamp is None:
+        return 0
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def encode_frame(readings):
+    """
+    Reference encoder: pack `(rule_id, timestamp, value)` readings into a binary frame.
+
+    A frame is `FRAME_MAGIC` followed by fixed-width little-endian records of rule id (int64), timestamp
+    in microseconds since the Unix epoch (int64, 0 for the time of ingestion) and value (float64).
+    Timestamps must be aware datetimes, or None for the time of ingestion.
+    """
+    readings = list(readings)
+    frame = bytearray(len(FRAME_MAGIC) + RECORD.size * len(readings))
+    frame[:len(FRAME_MAGIC)] = FRAME_MAGIC
+
+    for index, (rule_id, timestamp, value) in enumerate(readings):
+        RECORD.pack_into(frame, len(FRAME_MAGIC) + index * RECORD.size, rule_id, _to_microseconds(timestamp), value)
+
+    return bytes(frame)
+
+
+def decode_frame(frame):
+    """
+    Unpack a frame into `(rule_id, timestamp, value)` records without copying it, timestamps are left in
+    microseconds. Raises ValueError if the frame is malformed.
+    """
+    frame = memoryview(frame)
+
+    if frame[:len(FRAME_MAGIC)] != FRAME_MAGIC:
+        raise ValueError('Frame must start with the frame header')
+
+    records = frame[len(FRAME_MAGIC):]
+    if len(records) % RECORD.size:
+        raise ValueError(f'Frame body must consist of {RECORD.size}-byte records')
+
+    return list(RECORD.iter_unpack(records))
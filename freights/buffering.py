@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Per-process buffer which collects objects and passes them to `write` in one call every `interval` seconds
+    after the first object is buffered, or as soon as `max_size` objects are buffered, whichever comes first.
+
+    Writing is done by a background thread which is started on the first `add`, so it is started in the worker
+    process rather than in the one it was forked from. Remaining objects are written on interpreter exit.
+    When writing of buffered objects fails, objects of every `add` are written again on their own, so only
+    futures of the objects which fail are resolved with the error.
+    """
+    def __init__(self, write, interval, max_size):
+        self.write = write
+        self.interval = interval
+        self.max_size = max_size
+        self._objects = []
+        self._futures = []
+        self._first_added_at = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, objects):
+        """
+        Buffer objects. Returns a future which is resolved when they are written.
+        """
+        future = Future()
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Buffer is closed')
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+            if not self._futures:
+                self._first_added_at = time.monotonic()
+            self._objects.extend(objects)
+            self._futures.append((future, len(objects)))
+            self._condition.notify()
+
+        return future
+
+    def close(self):
+        """
+        Write buffered objects and stop the writing thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._is_due():
+                    timeout = self._first_added_at + self.interval - time.monotonic() if self._futures else None
+                    self._condition.wait(timeout)
+
+                objects, futures = self._objects, self._futures
+                self._objects, self._futures = [], []
+                closed = self._closed
+
+            if futures:
+                self._write(objects, futures)
+            if closed:
+                return
+
+    def _is_due(self):
+        if not self._futures:
+            return False
+        return len(self._objects) >= self.max_size or time.monotonic() >= self._first_added_at + self.interval
+
+    def _write(self, objects, futures):
+        close_old_connections()
+        try:
+            self.write(objects)
+        except Exception as exc:
+            if len(futures) > 1:
+                logger.warning('Failed to write %d buffered objects, writing them one add at a time', len(objects))
+                self._write_each(objects, futures)
+            else:
+                logger.exception('Failed to write %d buffered objects', len(objects))
+                futures[0][0].set_exception(exc)
+        else:
+            for future, count in futures:
+                future.set_result(None)
+        finally:
+            close_old_connections()
+
+    def _write_each(self, objects, futures):
+        start = 0
+
+        for future, count in futures:
+            try:
+                self.write(objects[start:start + count])
+            except Exception as exc:
+                logger.exception('Failed to write %d buffered objects', count)
+                future.set_exception(exc)
+            else:
+                future.set_result(None)
+            start += count
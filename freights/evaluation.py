@@ -0,0 +1,73 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+from freights.health import mark_damaged_freights
+from freights.models import Freight, Rule
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_CHUNK_SIZE = 500
+
+
+def evaluate_freights(freight_ids):
+    """
+    Evaluate health of freights with given ids and persist it. Returns ids of damaged freights.
+    """
+    return mark_damaged_freights(Freight.objects.filter(pk__in=freight_ids))
+
+
+class HealthEvaluator:
+    """
+    Re-evaluate health only of freights which rules got new states since their last evaluation.
+
+    Freights are split into chunks evaluated by a pool of worker processes, or in the current process when
+    concurrency is 1. Rules of freights which failed to be evaluated are marked as unevaluated again.
+    """
+    def __init__(self, concurrency=1, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.pool = None
+
+        if concurrency > 1:
+            self.pool = ProcessPoolExecutor(max_workers=concurrency, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=django.setup)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.pool:
+            self.pool.shutdown()
+
+    def evaluate_once(self):
+        """
+        Evaluate one batch of freights with unevaluated states. Returns ids of evaluated and damaged freights.
+        """
+        freight_ids = Rule.objects.take_unevaluated_freight_ids(self.batch_size)
+        chunks = [freight_ids[i:i + self.chunk_size] for i in range(0, len(freight_ids), self.chunk_size)]
+
+        evaluate = self.pool.map if self.pool else map
+        try:
+            damaged_freight_ids = [freight_id for damaged_chunk in evaluate(evaluate_freights, chunks)
+                                   for freight_id in damaged_chunk]
+        except Exception:
+            Rule.objects.filter(freight__in=freight_ids).update(has_unevaluated_states=True)
+            raise
+
+        return freight_ids, damaged_freight_ids
+
+    def run(self, interval, on_evaluated=None):
+        """
+        Evaluate freights until interrupted, waiting `interval` seconds when there is nothing to evaluate.
+        """
+        while True:
+            freight_ids, damaged_freight_ids = self.evaluate_once()
+
+            if on_evaluated and freight_ids:
+                on_evaluated(freight_ids, damaged_freight_ids)
+
+            if len(freight_ids) < self.batch_size:
+                time.sleep(interval)
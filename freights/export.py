@@ -0,0 +1,86 @@
+import csv
+import json
+import zlib
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+EXPORT_FIELDS = ['id', 'rule', 'timestamp', 'value']
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _format_timestamp(timestamp):
+    timestamp = timestamp.isoformat()
+    if timestamp.endswith('+00:00'):
+        timestamp = timestamp[:-6] + 'Z'
+    return timestamp
+
+
+def _iter_rows(states):
+    rows = states.values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for state_id, rule_id, timestamp, value in rows:
+        yield state_id, rule_id, _format_timestamp(timestamp), value
+
+
+def _iter_ndjson(states):
+    for row in _iter_rows(states):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def _iter_csv(states):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in _iter_rows(states):
+        yield writer.writerow(row)
+
+
+def _buffer(lines):
+    buffer = []
+    buffer_size = 0
+
+    for line in lines:
+        buffer.append(line)
+        buffer_size += len(line)
+
+        if buffer_size >= EXPORT_BUFFER_SIZE:
+            yield ''.join(buffer).encode()
+            buffer = []
+            buffer_size = 0
+
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+
+    yield compressor.flush()
+
+
+RENDERERS = {
+    'ndjson': (_iter_ndjson, 'application/x-ndjson'),
+    'csv': (_iter_csv, 'text/csv'),
+}
+
+
+def export_states(states, file_format, compress=False):
+    """
+    Lazily render states from the queryset as chunks of NDJSON or CSV file, optionally gzip-compressed.
+
+    States are read with a server-side cursor chunk by chunk, so memory use does not depend on the number of states.
+    Returns content type and iterator of the file chunks.
+    """
+    render, content_type = RENDERERS[file_format]
+    chunks = _buffer(render(states))
+
+    if compress:
+        return 'application/gzip', _gzip(chunks)
+    return content_type, chunks
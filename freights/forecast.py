@@ -0,0 +1,157 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, FloatField, Func, Sum, Value
+from django.utils import timezone
+
+from freights.models import Freight, Rule, StateRollup
+
+FORECAST_HORIZON = timedelta(days=7)
+FORECAST_STEPS = 500
+
+
+def _rollup_sums(freights, rule_ids, now):
+    """
+    Return per rule sums of minute rollup counts, values, times, times by values and squared times by counts,
+    over rollups within rule time interval. Rollups are placed in the middle of their buckets, time is in seconds
+    relative to `now`.
+    """
+    window_start = ExpressionWrapper(Value(now) - F('rule__time_interval'), output_field=DateTimeField())
+    rollups = StateRollup.objects.filter(rule__freight__in=freights, resolution=StateRollup.Resolution.MINUTE,
+                                         bucket__gte=window_start, bucket__lte=now)
+    offset = ExpressionWrapper(F('bucket') - Value(now), output_field=DurationField())
+
+    if connection.vendor == 'postgresql':
+        # Sums are computed by the database, so a row per rule is fetched rather than a row per rollup,
+        # DATE_PART is used as it returns double precision while EXTRACT returns much slower numeric
+        time = Func(Value('epoch'), offset, function='DATE_PART', output_field=FloatField()) + 30
+        rows = list(rollups.order_by().values('rule_id').annotate(
+            n=Sum('count'), sum_v=Sum('sum_value'), sum_t=Sum(F('count') * time),
+            sum_tv=Sum(time * F('sum_value')), sum_tt=Sum(F('count') * time * time),
+        ).values_list('rule_id', 'n', 'sum_v', 'sum_t', 'sum_tv', 'sum_tt'))
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        sums = np.zeros((5, len(rule_ids)))
+        sums[:, np.searchsorted(rule_ids, columns[:, 0].astype(np.int64))] = columns[:, 1:].T
+        return sums
+
+    rows = list(rollups.annotate(offset=offset).values_list('rule_id', 'offset', 'sum_value', 'count'))
+    rule_indexes = np.searchsorted(rule_ids, np.array([row[0] for row in rows], dtype=np.int64))
+    times = np.array([offset.total_seconds() + 30 for rule_id, offset, sum_value, count in rows], dtype=np.float64)
+    values = np.array([row[2] for row in rows], dtype=np.float64)
+    counts = np.array([row[3] for row in rows], dtype=np.float64)
+
+    def total(weights):
+        return np.bincount(rule_indexes, weights=weights, minlength=len(rule_ids))
+
+    return np.array([total(counts), total(values), total(counts * times), total(times * values),
+                     total(counts * times ** 2)])
+
+
+def _fit_trends(freights, rule_ids, interval_seconds, now):
+    """
+    Fit least-squares lines to values of rule states within rule time interval, using minute rollups weighted
+    by their counts. Time is in seconds relative to `now`. Returns slopes, intercepts and rates of states per second.
+    """
+    n, sum_v, sum_t, sum_tv, sum_tt = _rollup_sums(freights, rule_ids, now)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n * sum_tt - sum_t ** 2
+        slopes = np.where(denominator > 0, (n * sum_tv - sum_t * sum_v) / denominator, 0)
+        intercepts = np.where(n > 0, (sum_v - slopes * sum_t) / n, np.nan)
+
+    return slopes, intercepts, n / interval_seconds
+
+
+def _crossing_times(slopes, intercepts, low, high):
+    """
+    Return times since which trend lines are above `high` or below `low` for good and times until which they
+    are out of the limits from now on, both clipped at now.
+    """
+    inside = (low <= intercepts) & (intercepts <= high)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        to_low = (low - intercepts) / slopes
+        to_high = (high - intercepts) / slopes
+
+    # Flat lines outside the limits are out of them for good since now, so they never leave them
+    leave_times = np.where(slopes > 0, to_low, np.where(slopes < 0, to_high, 0))
+    enter_times = np.where(slopes > 0, to_high, np.where(slopes < 0, to_low, np.where(inside, np.inf, 0)))
+
+    return np.clip(enter_times, 0, None), np.clip(leave_times, 0, None)
+
+
+def forecast_damage(freights, now=None, horizon=FORECAST_HORIZON, steps=FORECAST_STEPS):
+    """
+    Forecast when freights from the queryset get damaged, in one vectorized pass over all their rules.
+
+    States of every rule are assumed to keep coming at the rate they came within rule time interval, with values
+    on the least-squares trend line of that interval. Counted violation probabilities are projected with them on
+    `steps` points up to `horizon` ahead and summed into damage levels, the first point where damage level
+    exceeds the threshold is compared with arrival datetime of reception service of the freight transfer.
+    """
+    now = now or timezone.now()
+    freight_rows = list(freights.order_by('pk').values_list('pk', 'transfer__reception_service__arrival_datetime'))
+    freight_ids = np.array([freight_id for freight_id, arrival_datetime in freight_rows], dtype=np.int64)
+
+    rules = Rule.objects.filter(freight__in=freights).order_by('pk')
+    rule_rows = list(rules.values_list('pk', 'freight_id', 'time_interval', 'coefficient', 'min_value', 'max_value',
+                                       'possible_deviation', 'states_count', 'out_of_limit_states_count',
+                                       'hard_violations_count', 'anomaly_score'))
+    columns = np.array([(rule_id, freight_id, time_interval.total_seconds(), *rest)
+                        for rule_id, freight_id, time_interval, *rest in rule_rows], dtype=np.float64).reshape(-1, 11)
+    (rule_ids, rule_freight_ids, interval_seconds, coefficients, min_values, max_values, possible_deviations,
+     states_count, out_of_limit_states_count, hard_violations_count, anomaly_scores) = columns.T
+    rule_ids = rule_ids.astype(np.int64)
+
+    slopes, intercepts, rates = _fit_trends(freights, rule_ids, interval_seconds, now)
+    has_trend = rates > 0
+    out_of_limit_since, out_of_limit_until = _crossing_times(slopes, intercepts, min_values, max_values)
+    hard_violation_since, hard_violation_until = _crossing_times(slopes, intercepts,
+                                                                 min_values - possible_deviations,
+                                                                 max_values + possible_deviations)
+    hard_violation_since = np.where(hard_violation_until > 0, 0, hard_violation_since)
+    hard_violation_since = np.where(has_trend, hard_violation_since, np.inf)
+
+    times = np.linspace(0, horizon.total_seconds(), steps + 1)
+    out_of_limit_time = (np.minimum(times, out_of_limit_until[:, None]) +
+                         np.maximum(times - np.maximum(out_of_limit_since, out_of_limit_until)[:, None], 0))
+    projected_states = states_count[:, None] + rates[:, None] * times
+    projected_out_of_limit_states = out_of_limit_states_count[:, None] + \
+        np.where(has_trend[:, None], rates[:, None] * out_of_limit_time, 0)
+
+    violation_probabilities = np.where(
+        (hard_violations_count[:, None] > 0) | (times >= hard_violation_since[:, None]),
+        Rule.MAX_VIOLATION_PROBABILITY,
+        np.clip(np.divide(projected_out_of_limit_states, projected_states,
+                          out=np.zeros_like(projected_states), where=projected_states > 0),
+                0, Rule.MAX_VIOLATION_PROBABILITY),
+    )
+    weight = settings.ANOMALY_SCORE_WEIGHT
+    probabilities = (1 - weight) * violation_probabilities + weight * anomaly_scores[:, None]
+    rule_damage = np.where(projected_states > Rule.MIN_NUMBER_OF_STATES, coefficients[:, None] * probabilities, 0)
+
+    damage_levels = np.zeros((len(freight_ids), len(times)))
+    np.add.at(damage_levels, np.searchsorted(freight_ids, rule_freight_ids.astype(np.int64)), rule_damage)
+
+    is_damaged = damage_levels > Freight.DAMAGE_THRESHOLD_VALUE
+    first_damaged_steps = is_damaged.argmax(axis=1)
+    will_be_damaged = is_damaged.any(axis=1)
+
+    forecasts = []
+    for index, (freight_id, arrival_datetime) in enumerate(freight_rows):
+        damage_datetime = None
+        if will_be_damaged[index]:
+            damage_datetime = now + timedelta(seconds=times[first_damaged_steps[index]])
+
+        forecasts.append({
+            'freight': freight_id,
+            'damage_level': float(damage_levels[index, 0]),
+            'damage_datetime': damage_datetime,
+            'arrival_datetime': arrival_datetime,
+            'damaged_before_arrival': bool(damage_datetime and arrival_datetime and
+                                           damage_datetime <= arrival_datetime),
+        })
+
+    return forecasts
@@ -0,0 +1,250 @@
+import asyncio
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from devices.cache import device_bounds
+from freight_terminal.async_api import run_in_orm_thread
+from freights.buffering import WriteBehindBuffer
+from freights.models import FreightHealth, Rule, State, StateRollup
+
+MAX_READINGS_PER_REQUEST = 10000
+BULK_CREATE_BATCH_SIZE = 1000
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+WRITE_BEHIND_ACK_ON_BUFFER = 'buffer'
+WRITE_BEHIND_ACK_ON_FLUSH = 'flush'
+
+_state_write_buffer = None
+
+
+def _parse_timestamp(timestamp, default):
+    if timestamp is None:
+        return default
+
+    if not isinstance(timestamp, str):
+        return None
+
+    try:
+        parsed_timestamp = parse_datetime(timestamp)
+    except ValueError:
+        return None
+
+    if parsed_timestamp and timezone.is_naive(parsed_timestamp):
+        parsed_timestamp = timezone.make_aware(parsed_timestamp)
+    return parsed_timestamp
+
+
+def _from_microseconds(timestamp, default):
+    if not timestamp:
+        return default
+
+    try:
+        return EPOCH + timedelta(microseconds=timestamp)
+    except OverflowError:
+        return None
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parse_value(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+
+    try:
+        value = float(value)
+    except (OverflowError, ValueError):
+        return None
+
+    return value if math.isfinite(value) else None
+
+
+def _validate_reading(rule, value, timestamp):
+    item_errors = {}
+
+    if not rule:
+        item_errors['rule'] = ['Rule does not exist.']
+
+    if value is None:
+        item_errors['value'] = ['A valid number is required.']
+    elif rule:
+        device = device_bounds.get(rule.device_id)
+        if value < device.min_value or value > device.max_value:
+            item_errors['value'] = ['Value must be between device min and max values.']
+
+    if not timestamp:
+        item_errors['timestamp'] = ['Datetime has wrong format.']
+
+    return item_errors
+
+
+def get_batch_error(readings):
+    """
+    Return why readings can not be ingested as one batch, or None if they can.
+    """
+    if not isinstance(readings, list):
+        return 'List of readings is expected'
+
+    if len(readings) > MAX_READINGS_PER_REQUEST:
+        return f'No more than {MAX_READINGS_PER_REQUEST} readings can be sent at once'
+
+    return None
+
+
+def validate_readings(readings):
+    """
+    Turn `{rule, value, timestamp}` readings into unsaved states.
+
+    Rules are loaded with one query for the whole batch, bounds of their devices come from the cache.
+    Returns unsaved states of valid readings and errors of invalid ones, keyed by their position in the batch.
+    """
+    rule_ids = {reading.get('rule') for reading in readings
+                if isinstance(reading, dict) and _is_id(reading.get('rule'))}
+    rules = Rule.objects.in_bulk(rule_ids)
+    now = timezone.now()
+
+    states = []
+    errors = []
+
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            errors.append({'index': index, 'errors': {'non_field_errors': ['Reading must be an object.']}})
+            continue
+
+        rule = rules.get(reading.get('rule')) if _is_id(reading.get('rule')) else None
+        value = _parse_value(reading.get('value'))
+        timestamp = _parse_timestamp(reading.get('timestamp'), default=now)
+        item_errors = _validate_reading(rule, value, timestamp)
+
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            states.append(State(rule=rule, value=value, timestamp=timestamp))
+
+    return states, errors
+
+
+def validate_records(records):
+    """
+    Turn `(rule, timestamp, value)` records decoded from a binary frame into unsaved states.
+
+    Timestamps are in microseconds since the Unix epoch, 0 stands for the time of ingestion. Returns the same
+    as `validate_readings`.
+    """
+    rules = Rule.objects.in_bulk({rule_id for rule_id, timestamp, value in records})
+    now = timezone.now()
+
+    states = []
+    errors = []
+
+    for index, (rule_id, timestamp, value) in enumerate(records):
+        rule = rules.get(rule_id)
+        value = _parse_value(value)
+        timestamp = _from_microseconds(timestamp, default=now)
+        item_errors = _validate_reading(rule, value, timestamp)
+
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            states.append(State(rule=rule, value=value, timestamp=timestamp))
+
+    return states, errors
+
+
+def create_states(states):
+    """
+    Insert states in bulk and update running counters, rollups and streaming statistics of their rules and health
+    summaries of their freights in the same transaction.
+    """
+    states_by_rule = defaultdict(list)
+    for state in states:
+        states_by_rule[state.rule].append(state)
+
+    with transaction.atomic():
+        State.objects.bulk_create(states, batch_size=BULK_CREATE_BATCH_SIZE)
+        # Rule rows are locked in order of their ids, so concurrent batches can not deadlock
+        for rule in sorted(states_by_rule, key=lambda rule: rule.pk):
+            Rule.objects.add_states(rule, states_by_rule[rule])
+            StateRollup.objects.add_states(rule, states_by_rule[rule])
+        FreightHealth.objects.refresh({rule.freight_id for rule in states_by_rule})
+
+    return states
+
+
+def get_state_write_buffer():
+    """
+    Return write-behind buffer of states of this process, or None if write-behind mode is off.
+    """
+    global _state_write_buffer
+
+    if not settings.STATE_WRITE_BEHIND:
+        return None
+
+    if _state_write_buffer is None:
+        _state_write_buffer = WriteBehindBuffer(create_states, interval=settings.STATE_WRITE_BEHIND_INTERVAL / 1000,
+                                                max_size=settings.STATE_WRITE_BEHIND_MAX_ROWS)
+    return _state_write_buffer
+
+
+def acknowledges_on_buffer():
+    """
+    Return whether new states are acknowledged before they are written.
+    """
+    return settings.STATE_WRITE_BEHIND and settings.STATE_WRITE_BEHIND_ACK == WRITE_BEHIND_ACK_ON_BUFFER
+
+
+def store_states(states):
+    """
+    Write states with `create_states`, or pass them to the write-behind buffer if they are acknowledged on buffering.
+
+    Synchronous views are run by one thread of the process, so while one of them waits for a flush no other states
+    could be buffered. States which are acknowledged after they are written are written by them at once.
+    """
+    if acknowledges_on_buffer():
+        get_state_write_buffer().add(states)
+        return states
+
+    return create_states(states)
+
+
+async def store_states_async(states):
+    """
+    Write states with `create_states`, or pass them to the write-behind buffer if write-behind mode is on.
+
+    In write-behind mode it waits until the states are written, unless they are acknowledged on buffering.
+    States of requests waiting concurrently are written in one batch, as no thread is held while waiting.
+    """
+    state_write_buffer = get_state_write_buffer()
+
+    if not state_write_buffer:
+        return await run_in_orm_thread(create_states, states)
+
+    written = state_write_buffer.add(states)
+    if not acknowledges_on_buffer():
+        await asyncio.wrap_future(written)
+    return states
+
+
+def ingest_readings(readings):
+    """
+    Validate readings and store states of the valid ones. Returns number of created states and errors.
+    """
+    states, errors = validate_readings(readings)
+    store_states(states)
+    return len(states), errors
+
+
+def ingest_records(records):
+    """
+    Validate records decoded from a binary frame and store states of the valid ones, same as `ingest_readings`.
+    """
+    states, errors = validate_records(records)
+    store_states(states)
+    return len(states), errors
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from freights.health import mark_damaged_freights
+from freights.models import Freight
+
+
+class Command(BaseCommand):
+    help = 'Check health of all active freights and mark damaged ones'
+
+    def handle(self, *args, **options):
+        damaged_freight_ids = mark_damaged_freights(Freight.objects.active())
+        self.stdout.write(self.style.SUCCESS(f'{len(damaged_freight_ids)} active freights are damaged'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from freights.evaluation import DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, HealthEvaluator
+
+
+class Command(BaseCommand):
+    help = 'Continuously re-evaluate health of freights which rules got new states'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Maximum number of rules taken for evaluation at once')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Number of freights evaluated by a worker at once')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait when there are no freights to evaluate')
+        parser.add_argument('--once', action='store_true', help='Evaluate one batch and exit')
+
+    def handle(self, *args, **options):
+        with HealthEvaluator(concurrency=options['concurrency'], batch_size=options['batch_size'],
+                             chunk_size=options['chunk_size']) as evaluator:
+            if options['once']:
+                self.report(*evaluator.evaluate_once())
+            else:
+                evaluator.run(options['interval'], on_evaluated=self.report)
+
+    def report(self, freight_ids, damaged_freight_ids):
+        self.stdout.write(self.style.SUCCESS(f'Evaluated {len(freight_ids)} freights, '
+                                             f'{len(damaged_freight_ids)} of them are damaged'))
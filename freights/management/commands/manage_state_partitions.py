@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from freights.partitioning import create_state_partitions, drop_expired_state_partitions, is_state_table_partitioned
+
+
+class Command(BaseCommand):
+    help = 'Create future monthly partitions of states table and drop expired ones according to retention policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of months after the current one to create partitions for')
+        parser.add_argument('--retention-months', type=int, default=settings.STATE_RETENTION_MONTHS,
+                            help='Number of months for which states are kept, defaults to STATE_RETENTION_MONTHS')
+        parser.add_argument('--detach-only', action='store_true',
+                            help='Detach expired partitions without dropping them')
+
+    def handle(self, *args, **options):
+        if not is_state_table_partitioned():
+            raise CommandError('States table is not partitioned. Set STATE_PARTITIONING and run migrations.')
+
+        for name in create_state_partitions(options['months_ahead']):
+            self.stdout.write(f'Created partition {name}')
+
+        if options['retention_months'] is not None:
+            for name in drop_expired_state_partitions(options['retention_months'],
+                                                      detach_only=options['detach_only']):
+                self.stdout.write(f'{"Detached" if options["detach_only"] else "Dropped"} partition {name}')
+
+        self.stdout.write(self.style.SUCCESS('States table partitions are up to date'))
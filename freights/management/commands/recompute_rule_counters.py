@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from freights.models import FreightHealth, Rule, StateRollup
+
+
+class Command(BaseCommand):
+    help = ('Rebuild running state counters, state rollups and streaming statistics of rules from stored states, '
+            'and health summaries of their freights')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--freight', type=int, action='append', dest='freights',
+                            help='Recompute only rules of the freight with this id (can be repeated)')
+        parser.add_argument('--rule', type=int, action='append', dest='rules',
+                            help='Recompute only the rule with this id (can be repeated)')
+
+    def handle(self, *args, **options):
+        rules = Rule.objects.all()
+
+        if options['freights']:
+            rules = rules.filter(freight__in=options['freights'])
+        if options['rules']:
+            rules = rules.filter(pk__in=options['rules'])
+
+        count = rules.recompute_state_counters()
+        StateRollup.objects.rebuild(rules)
+        rules.rebuild_streaming_stats()
+        FreightHealth.objects.refresh(rules.values_list('freight', flat=True))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed state counters, rollups and streaming statistics '
+                                             f'of {count} rules'))
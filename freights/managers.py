@@ -0,0 +1,342 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Count, DateTimeField, ExpressionWrapper, F, IntegerField, Max, Min, OuterRef, Q,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Coalesce, Greatest, Least, Trunc
+from django.utils import timezone
+
+
+class FreightQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(status__in=self.model.ACTIVE_STATUSES)
+
+
+class FreightManager(models.Manager.from_queryset(FreightQuerySet)):
+    pass
+
+
+class FreightHealthQuerySet(models.QuerySet):
+    SUMMARY_FIELDS = ['damage_level', 'worst_rule', 'last_state_timestamp', 'states_count', 'evaluated_at']
+
+    def refresh(self, freight_ids):
+        """
+        Recompute health summaries of freights with given ids from running counters and streaming statistics
+        of their rules, creating missing summaries.
+
+        Summaries are locked before rules are read, so concurrent refreshes of a freight are applied one after
+        another and the last one sees counters committed by the others.
+        """
+        Rule = apps.get_model('freights', 'Rule')
+        freight_ids = sorted(set(freight_ids))
+        now = timezone.now()
+
+        with transaction.atomic(savepoint=False):
+            existing_ids = set(self.select_for_update().filter(pk__in=freight_ids).order_by('pk')
+                               .values_list('pk', flat=True))
+
+            summaries = {freight_id: self.model(freight_id=freight_id, evaluated_at=now) for freight_id in freight_ids}
+            worst_damages = {}
+            rules = Rule.objects.filter(freight__in=freight_ids).only(
+                'freight', 'coefficient', 'states_count', 'out_of_limit_states_count', 'hard_violations_count',
+                'anomaly_score', 'last_state_timestamp',
+            )
+
+            for rule in rules:
+                summary = summaries[rule.freight_id]
+                summary.states_count += rule.states_count
+                if rule.last_state_timestamp and (not summary.last_state_timestamp or
+                                                  rule.last_state_timestamp > summary.last_state_timestamp):
+                    summary.last_state_timestamp = rule.last_state_timestamp
+
+                if rule.states_count > rule.MIN_NUMBER_OF_STATES:
+                    damage = rule.coefficient * rule.weigh_anomaly_score(rule.counted_violation_probability)
+                    summary.damage_level += damage
+                    if damage > worst_damages.get(rule.freight_id, 0):
+                        worst_damages[rule.freight_id] = damage
+                        summary.worst_rule = rule
+
+            self.bulk_create([summary for freight_id, summary in summaries.items() if freight_id not in existing_ids],
+                             ignore_conflicts=True)
+            self.bulk_update(summaries.values(), self.SUMMARY_FIELDS, batch_size=1000)
+
+        return len(summaries)
+
+
+class FreightHealthManager(models.Manager.from_queryset(FreightHealthQuerySet)):
+    pass
+
+
+class RuleQuerySet(models.QuerySet):
+    def with_violation_stats(self):
+        """
+        Annotate rules with the number of their states, out of limit states and hard violations.
+
+        Rule serializer guarantees that min value is not greater than max value, so deviation of out of limit
+        value is just its distance to the nearest exceeded limit.
+        """
+        out_of_limit = Q(states__value__gt=F('max_value')) | Q(states__value__lt=F('min_value'))
+        hard_violation = out_of_limit & (Q(states__value__gt=F('max_value') + F('possible_deviation')) |
+                                         Q(states__value__lt=F('min_value') - F('possible_deviation')))
+
+        return self.annotate(
+            num_of_states=Count('states'),
+            num_of_out_of_limit_states=Count('states', filter=out_of_limit),
+            num_of_hard_violations=Count('states', filter=hard_violation),
+        )
+
+    def with_windowed_violation_stats(self, now=None):
+        """
+        Annotate rules like `with_violation_stats`, but count only states within rule time interval before `now`.
+
+        Every count is a correlated subquery, which is a range scan over (rule, timestamp) index of states.
+        """
+        State = apps.get_model('freights', 'State')
+
+        window_start = ExpressionWrapper(Value(now or timezone.now()) - OuterRef('time_interval'),
+                                         output_field=DateTimeField())
+        window_states = State.objects.filter(rule=OuterRef('pk'), timestamp__gte=window_start).order_by()
+
+        out_of_limit = Q(value__gt=OuterRef('max_value')) | Q(value__lt=OuterRef('min_value'))
+        hard_violation = out_of_limit & (Q(value__gt=OuterRef('max_value') + OuterRef('possible_deviation')) |
+                                         Q(value__lt=OuterRef('min_value') - OuterRef('possible_deviation')))
+
+        def count(states):
+            states_count = states.values('rule').annotate(count=Count('pk')).values('count')
+            return Coalesce(Subquery(states_count, output_field=IntegerField()), 0)
+
+        return self.annotate(
+            num_of_states=count(window_states),
+            num_of_out_of_limit_states=count(window_states.filter(out_of_limit)),
+            num_of_hard_violations=count(window_states.filter(hard_violation)),
+        )
+
+    def update_state_counters(self, rule, values, sign=1):
+        """
+        Add values of new states to the running counters of the rule or remove them with `sign=-1`.
+        """
+        out_of_limit_states_count = 0
+        hard_violations_count = 0
+
+        for value in values:
+            is_out_of_limit, is_hard_violation = rule.classify_value(value)
+            out_of_limit_states_count += is_out_of_limit
+            hard_violations_count += is_hard_violation
+
+        return self.filter(pk=rule.pk).update(
+            states_count=F('states_count') + sign * len(values),
+            out_of_limit_states_count=F('out_of_limit_states_count') + sign * out_of_limit_states_count,
+            hard_violations_count=F('hard_violations_count') + sign * hard_violations_count,
+            has_unevaluated_states=True,
+        )
+
+    def recompute_state_counters(self):
+        """
+        Rebuild running counters from the stored states, e.g. after rule limits were changed.
+
+        Rules are locked in order of their ids before states are counted, like `add_states` locks them, so states
+        added meanwhile are either counted or added to the rebuilt counters afterwards.
+        """
+        with transaction.atomic():
+            self.lock()
+            rules = list(self.with_violation_stats())
+
+            for rule in rules:
+                rule.states_count = rule.num_of_states
+                rule.out_of_limit_states_count = rule.num_of_out_of_limit_states
+                rule.hard_violations_count = rule.num_of_hard_violations
+                rule.has_unevaluated_states = True
+
+            self.model.objects.bulk_update(rules, self.model.COUNTER_FIELDS)
+        return len(rules)
+
+    def lock(self):
+        """
+        Lock rows of rules in order of their ids, so concurrent lockers of several rules can not deadlock.
+        Has to be called in a transaction.
+        """
+        return list(self.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+    def add_states(self, rule, states):
+        """
+        Add new states of the rule to its running counters and fold them into its streaming statistics.
+
+        The rule row is locked and read once, so concurrent additions are applied one after another, and both
+        counters and statistics are written with a single update.
+        """
+        with transaction.atomic(savepoint=False):
+            locked_rule = self.select_for_update().get(pk=rule.pk)
+
+            for state in states:
+                is_out_of_limit, is_hard_violation = locked_rule.classify_value(state.value)
+                locked_rule.out_of_limit_states_count += is_out_of_limit
+                locked_rule.hard_violations_count += is_hard_violation
+            locked_rule.states_count += len(states)
+            locked_rule.has_unevaluated_states = True
+            locked_rule.fold_states(states)
+
+            return self.filter(pk=rule.pk).update(**{
+                field: getattr(locked_rule, field)
+                for field in self.model.COUNTER_FIELDS + self.model.STREAMING_STATS_FIELDS
+            })
+
+    def rebuild_streaming_stats(self, chunk_size=2000):
+        """
+        Rebuild streaming statistics by folding in stored states in order of their timestamps.
+
+        Rules are locked before their states are read, like in `recompute_state_counters`.
+        """
+        State = apps.get_model('freights', 'State')
+
+        with transaction.atomic():
+            self.lock()
+            rules = list(self)
+
+            for rule in rules:
+                rule.ewma_value, rule.ewma_variance, rule.ewma_rate = None, 0, 0
+                rule.last_state_value, rule.last_state_timestamp, rule.anomaly_score = None, None, 0
+
+                states = State.objects.filter(rule=rule).order_by('timestamp', 'pk').only('value', 'timestamp')
+                chunk = []
+                for state in states.iterator(chunk_size=chunk_size):
+                    chunk.append(state)
+                    if len(chunk) == chunk_size:
+                        rule.fold_states(chunk)
+                        chunk = []
+                rule.fold_states(chunk)
+
+            self.model.objects.bulk_update(rules, self.model.STREAMING_STATS_FIELDS)
+        return len(rules)
+
+    def take_unevaluated_freight_ids(self, limit):
+        """
+        Clear the mark of rules with unevaluated states and return ids of their freights, at most `limit` rules.
+
+        The mark is cleared before evaluation, so states which come during it mark their rules again.
+        """
+        rules = list(self.filter(has_unevaluated_states=True).values_list('pk', 'freight_id')[:limit])
+        self.filter(pk__in=[rule_id for rule_id, freight_id in rules]).update(has_unevaluated_states=False)
+        return sorted({freight_id for rule_id, freight_id in rules})
+
+
+class RuleManager(models.Manager.from_queryset(RuleQuerySet)):
+    pass
+
+
+class StateRollupQuerySet(models.QuerySet):
+    BUCKET_SIZES = {
+        'minute': timedelta(minutes=1),
+        'hour': timedelta(hours=1),
+    }
+
+    @staticmethod
+    def truncate_timestamp(timestamp, resolution):
+        timestamp = timestamp.astimezone(timezone.utc)
+
+        if resolution == 'hour':
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(second=0, microsecond=0)
+
+    def add_states(self, rule, states):
+        """
+        Merge new states of the rule into its rollups of every resolution.
+        """
+        buckets = {}
+
+        for state in states:
+            is_out_of_limit = rule.classify_value(state.value)[0]
+
+            for resolution in self.BUCKET_SIZES:
+                key = (resolution, self.truncate_timestamp(state.timestamp, resolution))
+                bucket = buckets.setdefault(key, {'min_value': state.value, 'max_value': state.value,
+                                                  'sum_value': 0, 'count': 0, 'out_of_limit_count': 0})
+                bucket['min_value'] = min(bucket['min_value'], state.value)
+                bucket['max_value'] = max(bucket['max_value'], state.value)
+                bucket['sum_value'] += state.value
+                bucket['count'] += 1
+                bucket['out_of_limit_count'] += is_out_of_limit
+
+        for (resolution, bucket_start), bucket in buckets.items():
+            self._merge_bucket(rule, resolution, bucket_start, bucket)
+
+    def _merge_bucket(self, rule, resolution, bucket_start, bucket):
+        rollups = self.filter(rule=rule, resolution=resolution, bucket=bucket_start)
+        changes = {
+            'min_value': Least(F('min_value'), Value(bucket['min_value'])),
+            'max_value': Greatest(F('max_value'), Value(bucket['max_value'])),
+            'sum_value': F('sum_value') + bucket['sum_value'],
+            'count': F('count') + bucket['count'],
+            'out_of_limit_count': F('out_of_limit_count') + bucket['out_of_limit_count'],
+        }
+
+        if rollups.update(**changes):
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(rule=rule, resolution=resolution, bucket=bucket_start, **bucket)
+        except IntegrityError:
+            # Rollup of the bucket was created concurrently
+            rollups.update(**changes)
+
+    def refresh_buckets(self, rule, timestamps):
+        """
+        Recompute rollups of the rule which contain given timestamps from stored states.
+
+        It is used when states are changed or deleted, as minimum and maximum can not be subtracted.
+        """
+        State = apps.get_model('freights', 'State')
+
+        for resolution, bucket_size in self.BUCKET_SIZES.items():
+            for bucket_start in {self.truncate_timestamp(timestamp, resolution) for timestamp in timestamps}:
+                states = State.objects.filter(rule=rule, timestamp__gte=bucket_start,
+                                              timestamp__lt=bucket_start + bucket_size)
+                bucket = states.aggregate(**self._bucket_aggregates())
+
+                if bucket['count']:
+                    self.update_or_create(rule=rule, resolution=resolution, bucket=bucket_start, defaults=bucket)
+                else:
+                    self.filter(rule=rule, resolution=resolution, bucket=bucket_start).delete()
+
+    def rebuild(self, rules):
+        """
+        Recreate all rollups of given rules from stored states, e.g. after rule limits were changed.
+
+        Rules are locked before their rollups are deleted, like they are locked before new states are merged
+        into rollups, so buckets are not created meanwhile and rollups are replaced all at once or not at all.
+        """
+        Rule = apps.get_model('freights', 'Rule')
+        State = apps.get_model('freights', 'State')
+
+        with transaction.atomic():
+            Rule.objects.filter(pk__in=[rule.pk for rule in rules]).lock()
+            self.filter(rule__in=rules).delete()
+
+            for resolution in self.BUCKET_SIZES:
+                buckets = (State.objects
+                           .filter(rule__in=rules)
+                           .annotate(bucket=Trunc('timestamp', resolution, tzinfo=timezone.utc))
+                           .order_by()
+                           .values('rule', 'bucket')
+                           .annotate(**self._bucket_aggregates()))
+
+                self.bulk_create([self.model(rule_id=bucket.pop('rule'), resolution=resolution, **bucket)
+                                  for bucket in buckets.iterator()],
+                                 batch_size=1000)
+
+    @staticmethod
+    def _bucket_aggregates():
+        out_of_limit = Q(value__gt=F('rule__max_value')) | Q(value__lt=F('rule__min_value'))
+
+        return {
+            'min_value': Min('value'),
+            'max_value': Max('value'),
+            'sum_value': Sum('value'),
+            'count': Count('pk'),
+            'out_of_limit_count': Count('pk', filter=out_of_limit),
+        }
+
+
+class StateRollupManager(models.Manager.from_queryset(StateRollupQuerySet)):
+    pass
@@ -0,0 +1,48 @@
+# Generated by Django 3.2 on 2026-10-18 13:51
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+
+
+def fill_state_counters(apps, schema_editor):
+    Rule = apps.get_model('freights', 'Rule')
+
+    out_of_limit = Q(states__value__gt=F('max_value')) | Q(states__value__lt=F('min_value'))
+    hard_violation = out_of_limit & (Q(states__value__gt=F('max_value') + F('possible_deviation')) |
+                                     Q(states__value__lt=F('min_value') - F('possible_deviation')))
+    rules = Rule.objects.annotate(num_of_states=Count('states'),
+                                  num_of_out_of_limit_states=Count('states', filter=out_of_limit),
+                                  num_of_hard_violations=Count('states', filter=hard_violation))
+
+    for rule in rules:
+        rule.states_count = rule.num_of_states
+        rule.out_of_limit_states_count = rule.num_of_out_of_limit_states
+        rule.hard_violations_count = rule.num_of_hard_violations
+
+    Rule.objects.bulk_update(rules, ['states_count', 'out_of_limit_states_count', 'hard_violations_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0004_auto_20210417_1808'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='hard_violations_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='hard violations count'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='out_of_limit_states_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='out of limit states count'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='states_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='states count'),
+        ),
+        migrations.RunPython(fill_state_counters, migrations.RunPython.noop),
+    ]
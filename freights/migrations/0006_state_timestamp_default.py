@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 13:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0005_rule_state_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='state',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='timestamp'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0006_state_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='state',
+            index=models.Index(fields=['rule', 'timestamp'], name='state_rule_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def fill_state_rollups(apps, schema_editor):
+    State = apps.get_model('freights', 'State')
+    StateRollup = apps.get_model('freights', 'StateRollup')
+
+    out_of_limit = Q(value__gt=F('rule__max_value')) | Q(value__lt=F('rule__min_value'))
+
+    for resolution in ['minute', 'hour']:
+        buckets = (State.objects
+                   .annotate(bucket=Trunc('timestamp', resolution, tzinfo=timezone.utc))
+                   .order_by()
+                   .values('rule', 'bucket')
+                   .annotate(min_value=Min('value'), max_value=Max('value'), sum_value=Sum('value'),
+                             count=Count('pk'), out_of_limit_count=Count('pk', filter=out_of_limit)))
+
+        StateRollup.objects.bulk_create([StateRollup(rule_id=bucket.pop('rule'), resolution=resolution, **bucket)
+                                         for bucket in buckets.iterator()],
+                                        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0007_state_rule_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], max_length=30, verbose_name='resolution')),
+                ('bucket', models.DateTimeField(verbose_name='bucket')),
+                ('min_value', models.FloatField(verbose_name='min value')),
+                ('max_value', models.FloatField(verbose_name='max value')),
+                ('sum_value', models.FloatField(verbose_name='sum value')),
+                ('count', models.PositiveIntegerField(verbose_name='count')),
+                ('out_of_limit_count', models.PositiveIntegerField(verbose_name='out of limit count')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='state_rollups', to='freights.rule')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='staterollup',
+            constraint=models.UniqueConstraint(fields=('rule', 'resolution', 'bucket'), name='unique_state_rollup_bucket'),
+        ),
+        migrations.RunPython(fill_state_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.migrations.exceptions import IrreversibleError
+
+
+def is_state_table_partitioned(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+                       'JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid '
+                       "WHERE pg_class.relname = 'freights_state')")
+        return cursor.fetchone()[0]
+
+
+def partition_state_table(apps, schema_editor):
+    """
+    Turn states table into a table partitioned by timestamp with a default partition.
+
+    Monthly partitions are created by `manage_state_partitions` command. Partitioned table can not have
+    a primary key without partition key, so it consists of id and timestamp.
+    """
+    if (schema_editor.connection.vendor != 'postgresql'
+            or not settings.STATE_PARTITIONING
+            or is_state_table_partitioned(schema_editor)):
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence('freights_state', 'id')")
+        id_sequence = cursor.fetchone()[0]
+
+    schema_editor.execute('ALTER TABLE freights_state RENAME TO freights_state_unpartitioned')
+    schema_editor.execute('ALTER TABLE freights_state_unpartitioned '
+                          'RENAME CONSTRAINT freights_state_pkey TO freights_state_unpartitioned_pkey')
+    schema_editor.execute('ALTER INDEX state_rule_timestamp_idx RENAME TO state_rule_timestamp_unpartitioned_idx')
+
+    schema_editor.execute('CREATE TABLE freights_state (LIKE freights_state_unpartitioned INCLUDING DEFAULTS) '
+                          'PARTITION BY RANGE (timestamp)')
+    schema_editor.execute(f'ALTER SEQUENCE {id_sequence} OWNED BY freights_state.id')
+    schema_editor.execute('ALTER TABLE freights_state ADD CONSTRAINT freights_state_pkey PRIMARY KEY (id, timestamp)')
+    schema_editor.execute('ALTER TABLE freights_state ADD CONSTRAINT freights_state_rule_id_fk_freights_rule_id '
+                          'FOREIGN KEY (rule_id) REFERENCES freights_rule (id) DEFERRABLE INITIALLY DEFERRED')
+    schema_editor.execute('CREATE INDEX state_rule_timestamp_idx ON freights_state (rule_id, timestamp)')
+    schema_editor.execute('CREATE TABLE freights_state_default PARTITION OF freights_state DEFAULT')
+
+    schema_editor.execute('INSERT INTO freights_state SELECT * FROM freights_state_unpartitioned')
+    schema_editor.execute('DROP TABLE freights_state_unpartitioned')
+
+
+def check_state_table_not_partitioned(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql' and is_state_table_partitioned(schema_editor):
+        raise IrreversibleError('Partitioned states table can not be turned back into a regular one.')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0008_state_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_state_table, check_state_table_not_partitioned),
+    ]
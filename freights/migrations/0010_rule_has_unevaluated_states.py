@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0009_partition_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='has_unevaluated_states',
+            field=models.BooleanField(default=False, verbose_name='has unevaluated states'),
+        ),
+        migrations.AddIndex(
+            model_name='rule',
+            index=models.Index(condition=models.Q(has_unevaluated_states=True), fields=['freight'], name='rule_unevaluated_states_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0010_rule_has_unevaluated_states'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rule',
+            name='anomaly_score',
+            field=models.FloatField(default=0, verbose_name='anomaly score'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='ewma_rate',
+            field=models.FloatField(default=0, verbose_name='EWMA rate of change per second'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='ewma_value',
+            field=models.FloatField(null=True, verbose_name='EWMA value'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='ewma_variance',
+            field=models.FloatField(default=0, verbose_name='EWMA variance'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='last_state_timestamp',
+            field=models.DateTimeField(null=True, verbose_name='last state timestamp'),
+        ),
+        migrations.AddField(
+            model_name='rule',
+            name='last_state_value',
+            field=models.FloatField(null=True, verbose_name='last state value'),
+        ),
+    ]
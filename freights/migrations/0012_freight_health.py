@@ -0,0 +1,68 @@
+# Generated by Django 3.2 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import django.utils.timezone
+
+MIN_NUMBER_OF_STATES = 10
+MAX_VIOLATION_PROBABILITY = 1
+
+
+def fill_freight_health(apps, schema_editor):
+    Freight = apps.get_model('freights', 'Freight')
+    FreightHealth = apps.get_model('freights', 'FreightHealth')
+    Rule = apps.get_model('freights', 'Rule')
+
+    now = timezone.now()
+    summaries = {freight_id: FreightHealth(freight_id=freight_id, evaluated_at=now)
+                 for freight_id in Freight.objects.values_list('pk', flat=True)}
+    worst_damages = {}
+    weight = settings.ANOMALY_SCORE_WEIGHT
+
+    for rule in Rule.objects.iterator():
+        summary = summaries[rule.freight_id]
+        summary.states_count += rule.states_count
+        if rule.last_state_timestamp and (not summary.last_state_timestamp or
+                                          rule.last_state_timestamp > summary.last_state_timestamp):
+            summary.last_state_timestamp = rule.last_state_timestamp
+
+        if rule.states_count > MIN_NUMBER_OF_STATES:
+            if rule.hard_violations_count:
+                violation_probability = MAX_VIOLATION_PROBABILITY
+            else:
+                violation_probability = rule.out_of_limit_states_count / rule.states_count
+            damage = rule.coefficient * ((1 - weight) * violation_probability + weight * rule.anomaly_score)
+            summary.damage_level += damage
+            if damage > worst_damages.get(rule.freight_id, 0):
+                worst_damages[rule.freight_id] = damage
+                summary.worst_rule = rule
+
+    FreightHealth.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('freights', '0011_rule_streaming_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreightHealth',
+            fields=[
+                ('freight', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='health', serialize=False, to='freights.freight')),
+                ('damage_level', models.FloatField(default=0, verbose_name='damage level')),
+                ('last_state_timestamp', models.DateTimeField(null=True, verbose_name='last state timestamp')),
+                ('states_count', models.PositiveIntegerField(default=0, verbose_name='states count')),
+                ('evaluated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='evaluated at')),
+                ('worst_rule', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='freights.rule')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='freighthealth',
+            index=models.Index(fields=['damage_level'], name='freight_health_damage_idx'),
+        ),
+        migrations.RunPython(fill_freight_health, migrations.RunPython.noop),
+    ]
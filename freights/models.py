@@ -1,12 +1,19 @@
+import math
 from datetime import timedelta
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from django.core.validators import MaxValueValidator
 
+from freight_terminal.events import BroadcastChangesMixin
+from freight_terminal.transitions import Transition, transition
+from freights.managers import FreightHealthManager, FreightManager, RuleManager, StateRollupManager
 
-class Freight(models.Model):
+
+class Freight(BroadcastChangesMixin, models.Model):
     DAMAGE_THRESHOLD_VALUE = 0.2
 
     class Status(models.TextChoices):
@@ -20,11 +27,24 @@ class Freight(models.Model):
         RETURNING = 'returning', _('Returning')
         RETURNED = 'returned', _('Returned')
 
+    ACTIVE_STATUSES = [Status.WAITING, Status.IN_DELIVERY_TRANSIT, Status.TRANSFERING, Status.IN_RECEPTION_TRANSIT,
+                       Status.RETURNING]
+    TRANSITIONS = {
+        'start_return': Transition(sources=[Status.NOT_ASSIGNED, Status.WAITING, Status.IN_DELIVERY_TRANSIT,
+                                            Status.TRANSFERING, Status.IN_RECEPTION_TRANSIT, Status.DELIVERED],
+                                   target=Status.RETURNING),
+        'finish_return': Transition(sources=[Status.RETURNING], target=Status.RETURNED),
+    }
+
     name = models.CharField(_('name'), max_length=150)
     status = models.CharField(_('status'), max_length=30, choices=Status.choices)
     transfer = models.OneToOneField('companies.Transfer', on_delete=models.CASCADE, null=True)
     is_damaged = models.BooleanField(_('is damaged'), default=False)
 
+    objects = FreightManager()
+
+    broadcast_fields = ('status', 'is_damaged')
+
     def __str__(self):
         return self.name
 
@@ -35,25 +55,91 @@ class Freight(models.Model):
     def damage_level(self):
         damage_level = 0
 
+        for rule in self.rules.all():
+            if rule.states_count > rule.MIN_NUMBER_OF_STATES:
+                damage_level += rule.coefficient * rule.weigh_anomaly_score(rule.counted_violation_probability)
+
+        return damage_level
+
+    @property
+    def aggregated_damage_level(self):
+        return self._sum_damage_of_rules(self.rules.with_violation_stats())
+
+    @property
+    def windowed_damage_level(self):
+        """
+        Damage level which takes into account only states within time interval of their rule.
+        """
+        return self._sum_damage_of_rules(self.rules.with_windowed_violation_stats())
+
+    @staticmethod
+    def _sum_damage_of_rules(rules):
+        damage_level = 0
+
+        for rule in rules:
+            if rule.num_of_states > rule.MIN_NUMBER_OF_STATES:
+                violation_probability = Rule.calculate_violation_probability(
+                    rule.num_of_states, rule.num_of_out_of_limit_states, rule.num_of_hard_violations
+                )
+                damage_level += rule.coefficient * rule.weigh_anomaly_score(violation_probability)
+
+        return damage_level
+
+    @property
+    def reference_damage_level(self):
+        """
+        Evaluate damage level state by state in Python.
+
+        It is kept only to check that `damage_level` and `aggregated_damage_level` give the same result.
+        """
+        damage_level = 0
+
         for rule in self.rules.all():
             if rule.states.count() > rule.MIN_NUMBER_OF_STATES:
-                damage_level += rule.coefficient * rule.violation_probability
+                damage_level += rule.coefficient * rule.weigh_anomaly_score(rule.violation_probability)
 
         return damage_level
 
     def start_return(self):
-        self.status = self.Status.RETURNING
-        self.transfer.start_freight_return()
-        self.save()
+        with transaction.atomic():
+            self.status = transition(Freight, 'start_return', [self.pk])
+            self.transfer.start_freight_return()
 
     def finish_return(self):
-        self.status = self.Status.RETURNED
-        self.save()
+        self.status = transition(Freight, 'finish_return', [self.pk])
+
+
+class FreightHealth(models.Model):
+    """
+    Denormalized health summary of a freight, refreshed with `FreightHealth.objects.refresh` when states of its
+    rules or the rules themselves change, so freights can be listed with their health without evaluating it.
+    """
+    freight = models.OneToOneField('Freight', on_delete=models.CASCADE, primary_key=True, related_name='health')
+    damage_level = models.FloatField(_('damage level'), default=0)
+    worst_rule = models.ForeignKey('Rule', on_delete=models.SET_NULL, null=True, related_name='+')
+    last_state_timestamp = models.DateTimeField(_('last state timestamp'), null=True)
+    states_count = models.PositiveIntegerField(_('states count'), default=0)
+    evaluated_at = models.DateTimeField(_('evaluated at'), default=timezone.now)
+
+    objects = FreightHealthManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['damage_level'], name='freight_health_damage_idx'),
+        ]
+
+    def __str__(self):
+        return f'Health of {self.freight_id}'
 
 
 class Rule(models.Model):
     MIN_NUMBER_OF_STATES = 10
     MAX_VIOLATION_PROBABILITY = 1
+    # Deviation from moving average, in moving standard deviations, at which anomaly score reaches its maximum
+    ANOMALY_Z_SCORE_LIMIT = 3
+    COUNTER_FIELDS = ['states_count', 'out_of_limit_states_count', 'hard_violations_count', 'has_unevaluated_states']
+    STREAMING_STATS_FIELDS = ['ewma_value', 'ewma_variance', 'ewma_rate', 'last_state_value', 'last_state_timestamp',
+                              'anomaly_score']
 
     coefficient = models.FloatField(_('coefficient'), validators=[MaxValueValidator(1.0)])
     max_value = models.FloatField(_('max value'))
@@ -63,9 +149,96 @@ class Rule(models.Model):
     freight = models.ForeignKey('Freight', on_delete=models.CASCADE, related_name='rules')
     device = models.ForeignKey('devices.Device', on_delete=models.CASCADE, related_name='rules')
 
+    # Running counters of rule states, maintained by `State.save` and `State.delete`
+    states_count = models.PositiveIntegerField(_('states count'), default=0)
+    out_of_limit_states_count = models.PositiveIntegerField(_('out of limit states count'), default=0)
+    hard_violations_count = models.PositiveIntegerField(_('hard violations count'), default=0)
+    # Set when counters change and cleared by health evaluator when it takes the rule freight for evaluation
+    has_unevaluated_states = models.BooleanField(_('has unevaluated states'), default=False)
+
+    # Streaming statistics of rule states, folded in state by state with `fold_states`
+    ewma_value = models.FloatField(_('EWMA value'), null=True)
+    ewma_variance = models.FloatField(_('EWMA variance'), default=0)
+    ewma_rate = models.FloatField(_('EWMA rate of change per second'), default=0)
+    last_state_value = models.FloatField(_('last state value'), null=True)
+    last_state_timestamp = models.DateTimeField(_('last state timestamp'), null=True)
+    anomaly_score = models.FloatField(_('anomaly score'), default=0)
+
+    objects = RuleManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['freight'], condition=models.Q(has_unevaluated_states=True),
+                         name='rule_unevaluated_states_idx'),
+        ]
+
     def __str__(self):
         return f'{self.device}({self.freight})'
 
+    @classmethod
+    def calculate_violation_probability(cls, num_of_states, num_of_out_of_limit_states, num_of_hard_violations):
+        if num_of_hard_violations:
+            return cls.MAX_VIOLATION_PROBABILITY
+        return num_of_out_of_limit_states / num_of_states if num_of_states else 0
+
+    def classify_value(self, value):
+        """
+        Return whether the value is out of rule limits and whether it exceeds possible deviation.
+        """
+        if self.min_value <= value <= self.max_value:
+            return False, False
+
+        deviation = min(abs(value - self.max_value), abs(value - self.min_value))
+        return True, deviation > self.possible_deviation
+
+    def fold_states(self, states):
+        """
+        Update streaming statistics with states in O(1) per state, without saving them.
+
+        Mean and variance of values and their rate of change are exponentially weighted moving ones. Anomaly score
+        is the largest of deviation of the last value from the moving mean, relative to `ANOMALY_Z_SCORE_LIMIT`
+        moving standard deviations, and share of the rule range which values cross within rule time interval at
+        the moving rate. States older than the last folded one do not change the rate.
+        """
+        alpha = settings.ANOMALY_EWMA_ALPHA
+        rule_range = self.max_value - self.min_value
+
+        for state in sorted(states, key=lambda state: state.timestamp):
+            if self.ewma_value is None:
+                self.ewma_value = state.value
+                self.ewma_variance = 0
+            else:
+                deviation = state.value - self.ewma_value
+                z_score = abs(deviation) / math.sqrt(self.ewma_variance) if self.ewma_variance > 0 else 0
+
+                self.ewma_value += alpha * deviation
+                self.ewma_variance = (1 - alpha) * (self.ewma_variance + alpha * deviation ** 2)
+
+                if self.last_state_timestamp and state.timestamp > self.last_state_timestamp:
+                    seconds = (state.timestamp - self.last_state_timestamp).total_seconds()
+                    rate = (state.value - self.last_state_value) / seconds
+                    self.ewma_rate += alpha * (rate - self.ewma_rate)
+
+                drift = abs(self.ewma_rate) * self.time_interval.total_seconds() / rule_range if rule_range else 0
+                self.anomaly_score = min(max(z_score / self.ANOMALY_Z_SCORE_LIMIT, drift), 1)
+
+            if not self.last_state_timestamp or state.timestamp >= self.last_state_timestamp:
+                self.last_state_value = state.value
+                self.last_state_timestamp = state.timestamp
+
+    def weigh_anomaly_score(self, violation_probability):
+        """
+        Mix violation probability with anomaly score of the rule according to `ANOMALY_SCORE_WEIGHT` setting.
+        """
+        weight = settings.ANOMALY_SCORE_WEIGHT
+        return (1 - weight) * violation_probability + weight * self.anomaly_score
+
+    @property
+    def counted_violation_probability(self):
+        return self.calculate_violation_probability(self.states_count,
+                                                    self.out_of_limit_states_count,
+                                                    self.hard_violations_count)
+
     @property
     def violation_probability(self) -> int:
         out_of_limit_values = 0
@@ -84,11 +257,76 @@ class Rule(models.Model):
 
 class State(models.Model):
     value = models.FloatField(_('value'))
-    timestamp = models.DateTimeField(_('timestamp'), auto_now_add=True)
+    timestamp = models.DateTimeField(_('timestamp'), default=timezone.now)
     rule = models.ForeignKey('Rule', on_delete=models.CASCADE, related_name='states')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['rule', 'timestamp'], name='state_rule_timestamp_idx'),
+        ]
+
     def __str__(self):
         return f'{self.rule} at {self.timestamp}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = State.objects.select_related('rule').filter(pk=self.pk).first()
+                if previous:
+                    Rule.objects.update_state_counters(previous.rule, [previous.value], sign=-1)
+
+            super().save(*args, **kwargs)
+
+            if previous:
+                Rule.objects.update_state_counters(self.rule, [self.value])
+                StateRollup.objects.refresh_buckets(previous.rule, [previous.timestamp])
+                StateRollup.objects.refresh_buckets(self.rule, [self.timestamp])
+                FreightHealth.objects.refresh({previous.rule.freight_id, self.rule.freight_id})
+            else:
+                Rule.objects.add_states(self.rule, [self])
+                StateRollup.objects.add_states(self.rule, [self])
+                FreightHealth.objects.refresh([self.rule.freight_id])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Rule.objects.update_state_counters(self.rule, [self.value], sign=-1)
+            deleted = super().delete(*args, **kwargs)
+            StateRollup.objects.refresh_buckets(self.rule, [self.timestamp])
+            FreightHealth.objects.refresh([self.rule.freight_id])
+            return deleted
+
+
+class StateRollup(models.Model):
+    """
+    Aggregated states of a rule within one time bucket.
+    """
+    class Resolution(models.TextChoices):
+        MINUTE = 'minute', _('Minute')
+        HOUR = 'hour', _('Hour')
+
+    rule = models.ForeignKey('Rule', on_delete=models.CASCADE, related_name='state_rollups')
+    resolution = models.CharField(_('resolution'), max_length=30, choices=Resolution.choices)
+    bucket = models.DateTimeField(_('bucket'))
+    min_value = models.FloatField(_('min value'))
+    max_value = models.FloatField(_('max value'))
+    sum_value = models.FloatField(_('sum value'))
+    count = models.PositiveIntegerField(_('count'))
+    out_of_limit_count = models.PositiveIntegerField(_('out of limit count'))
+
+    objects = StateRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'resolution', 'bucket'], name='unique_state_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.rule} at {self.bucket} per {self.resolution}'
+
+    @property
+    def mean_value(self):
+        return self.sum_value / self.count if self.count else None
+
 
 
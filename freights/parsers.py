@@ -0,0 +1,16 @@
+from rest_framework import exceptions, parsers
+
+from freights.binary import decode_frame
+
+
+class StateFrameParser(parsers.BaseParser):
+    """
+    Parse a binary frame of states into a list of `(rule_id, timestamp, value)` records.
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode_frame(stream.read() if stream else b'')
+        except ValueError as exc:
+            raise exceptions.ParseError(str(exc))
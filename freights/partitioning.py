@@ -0,0 +1,142 @@
+import re
+from datetime import date, datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from freights.models import FreightHealth, Rule, State
+
+DEFAULT_PARTITION_SUFFIX = 'default'
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _month_start(month):
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def _current_month():
+    return timezone.now().astimezone(timezone.utc).date().replace(day=1)
+
+
+def _partition_name(month):
+    return f'{State._meta.db_table}_y{month.year}m{month.month:02d}'
+
+
+def _default_partition_name():
+    return f'{State._meta.db_table}_{DEFAULT_PARTITION_SUFFIX}'
+
+
+def is_state_table_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+                       'JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid '
+                       'WHERE pg_class.relname = %s)', [State._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def get_state_partitions():
+    """
+    Return months of existing monthly partitions of states table mapped to partition names.
+    """
+    pattern = re.compile(rf'^{State._meta.db_table}_y(\d{{4}})m(\d{{2}})$')
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT child.relname FROM pg_inherits '
+                       'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                       'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                       'WHERE parent.relname = %s', [State._meta.db_table])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+
+    return partitions
+
+
+def create_state_partitions(months_ahead):
+    """
+    Create monthly partitions of states table up to `months_ahead` months after the current one.
+
+    States which got into the default partition are moved to the partitions of their months.
+    Returns names of created partitions.
+    """
+    table = connection.ops.quote_name(State._meta.db_table)
+    default_partition = connection.ops.quote_name(_default_partition_name())
+    existing_partitions = get_state_partitions()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(timestamp) FROM {default_partition}')
+        earliest_default_timestamp = cursor.fetchone()[0]
+
+    month = _current_month()
+    if earliest_default_timestamp:
+        month = min(month, earliest_default_timestamp.astimezone(timezone.utc).date().replace(day=1))
+
+    created_partitions = []
+    last_month = _add_months(_current_month(), months_ahead)
+
+    while month <= last_month:
+        if month not in existing_partitions:
+            name = _partition_name(month)
+            partition = connection.ops.quote_name(name)
+            bounds = [_month_start(month), _month_start(_add_months(month, 1))]
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                cursor.execute(f'WITH moved AS (DELETE FROM {default_partition} '
+                               f'WHERE timestamp >= %s AND timestamp < %s RETURNING *) '
+                               f'INSERT INTO {partition} SELECT * FROM moved', bounds)
+                cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)',
+                               bounds)
+
+            created_partitions.append(name)
+
+        month = _add_months(month, 1)
+
+    return created_partitions
+
+
+def drop_expired_state_partitions(retention_months, detach_only=False):
+    """
+    Detach and drop monthly partitions of states table which are older than `retention_months` months.
+
+    Running counters and streaming statistics of rules which lost their states are rebuilt from the remaining
+    states and health summaries of their freights are refreshed, state rollups are kept as they are.
+    Returns names of dropped (or only detached) partitions.
+    """
+    table = connection.ops.quote_name(State._meta.db_table)
+    retention_start = _add_months(_current_month(), -retention_months)
+
+    expired_partitions = [name for month, name in sorted(get_state_partitions().items())
+                          if _add_months(month, 1) <= retention_start]
+    affected_rule_ids = set()
+
+    for name in expired_partitions:
+        partition = connection.ops.quote_name(name)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'SELECT DISTINCT rule_id FROM {partition}')
+            affected_rule_ids.update(row[0] for row in cursor.fetchall())
+
+            cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {partition}')
+            if not detach_only:
+                cursor.execute(f'DROP TABLE {partition}')
+
+    if affected_rule_ids:
+        rules = Rule.objects.filter(pk__in=affected_rule_ids)
+        with transaction.atomic():
+            rules.recompute_state_counters()
+            rules.rebuild_streaming_stats()
+            FreightHealth.objects.refresh(rules.values_list('freight_id', flat=True))
+
+    return expired_partitions
@@ -0,0 +1,71 @@
+from django.db import transaction
+
+from companies.models import Service
+from freight_terminal.transitions import transition
+from freights.models import Freight
+
+MAX_FREIGHTS_PER_RETURN = 1000
+
+
+def _get_return_error(freight, service_statuses):
+    if not freight:
+        return 'Freight does not exist'
+
+    freight_status, delivery_service_id, reception_service_id = freight
+    if not delivery_service_id:
+        return 'Transfer is not assigned to the freight'
+
+    if freight_status not in Freight.TRANSITIONS['start_return'].sources:
+        return 'Freight is already on his way to be returned'
+
+    service_sources = Service.TRANSITIONS['start_freight_return'].sources
+    if any(service_statuses[service_id] not in service_sources
+           for service_id in [delivery_service_id, reception_service_id]):
+        return 'Services of the freight transfer are already returning a freight'
+
+    return None
+
+
+def start_freight_returns(freight_ids):
+    """
+    Start return of freights with given ids and of delivery and reception services of their transfers
+    in one transaction.
+
+    Freights and their services are locked and validated before any of them is changed. Freights which can not
+    be returned are reported with errors, the others are returned with one UPDATE of freights and one of services.
+    Returns ids of returned freights and errors.
+    """
+    freight_ids = list(dict.fromkeys(freight_ids))
+
+    with transaction.atomic():
+        freights = (Freight.objects
+                    .select_for_update(of=('self',))
+                    .filter(pk__in=freight_ids)
+                    .order_by('pk')
+                    .values_list('pk', 'status', 'transfer__delivery_service', 'transfer__reception_service'))
+        freights = {freight_id: rest for freight_id, *rest in freights}
+
+        service_ids = [service_id for status, *freight_service_ids in freights.values()
+                       for service_id in freight_service_ids if service_id]
+        service_statuses = dict(Service.objects.select_for_update().filter(pk__in=service_ids).order_by('pk')
+                                .values_list('pk', 'status'))
+
+        returned_freight_ids = []
+        returned_service_ids = []
+        errors = []
+
+        for freight_id in freight_ids:
+            freight = freights.get(freight_id)
+            error = _get_return_error(freight, service_statuses)
+
+            if error:
+                errors.append({'freight': freight_id, 'errors': [error]})
+            else:
+                returned_freight_ids.append(freight_id)
+                returned_service_ids.extend(freight[1:])
+
+        if returned_freight_ids:
+            transition(Freight, 'start_return', returned_freight_ids)
+            transition(Service, 'start_freight_return', returned_service_ids)
+
+    return returned_freight_ids, errors
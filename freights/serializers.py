@@ -1,12 +1,21 @@
 from rest_framework import serializers
 
-from freights.models import Freight, Rule, State
+from devices.cache import device_bounds
+from freights.models import Freight, FreightHealth, Rule, State, StateRollup
+from freights.returns import MAX_FREIGHTS_PER_RETURN
 from companies.models import Transfer
 from companies.serializers import TransferSerializer
 
 
+class FreightHealthSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FreightHealth
+        fields = ['damage_level', 'worst_rule', 'last_state_timestamp', 'states_count', 'evaluated_at']
+
+
 class FreightSerializer(serializers.ModelSerializer):
     transfer = TransferSerializer(required=False)
+    health = FreightHealthSerializer(read_only=True)
 
     class Meta:
         model = Freight
@@ -64,13 +73,19 @@ class FreightSerializer(serializers.ModelSerializer):
         return instance
 
 
+class FreightReturnSerializer(serializers.Serializer):
+    freights = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                     max_length=MAX_FREIGHTS_PER_RETURN)
+
+
 class RuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rule
         fields = '__all__'
+        read_only_fields = [*Rule.COUNTER_FIELDS, *Rule.STREAMING_STATS_FIELDS]
 
     def validate(self, attrs):
-        device = attrs.get('device', self.instance.device if self.instance else None)
+        device = attrs.get('device', device_bounds.get(self.instance.device_id) if self.instance else None)
         min_value = attrs.get('min_value', self.instance.min_value if self.instance else None)
         max_value = attrs.get('max_value', self.instance.max_value if self.instance else None)
 
@@ -83,6 +98,14 @@ class RuleSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    def update(self, instance, validated_data):
+        # Only edited fields are written, so counters and statistics changed by concurrent ingestion are kept
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+
+        return instance
+
 
 class StateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -96,9 +119,26 @@ class StateSerializer(serializers.ModelSerializer):
         if self.instance and not rule:
             rule = self.instance.rule
 
-        if (rule
-                and value
-                and (value < rule.device.min_value or value > rule.device.max_value)):
-            raise serializers.ValidationError({'value': 'Value must be between device min and max values.'})
+        if rule and value:
+            device = device_bounds.get(rule.device_id)
+            if value < device.min_value or value > device.max_value:
+                raise serializers.ValidationError({'value': 'Value must be between device min and max values.'})
 
         return attrs
+
+
+class StateRollupSerializer(serializers.ModelSerializer):
+    mean_value = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = StateRollup
+        fields = ['bucket', 'resolution', 'min_value', 'max_value', 'mean_value', 'count', 'out_of_limit_count']
+
+
+class StateFilterSerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+
+class StateRollupFilterSerializer(StateFilterSerializer):
+    resolution = serializers.ChoiceField(choices=StateRollup.Resolution.choices, default=StateRollup.Resolution.HOUR)
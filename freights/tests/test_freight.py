@@ -1,12 +1,25 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from test_data import fake
 from test_data.companies.service import create_robot_service
+from test_data.devices.device import create_device
 from test_data.freights.freight import create_freight
 from companies.models import Service
-from freights.models import Freight
+from freight_terminal.events import Broadcaster
+from freights.evaluation import HealthEvaluator
+from freights.forecast import forecast_damage
+from freights.health import calculate_damage_levels
+from freights.ingestion import create_states
+from freights.models import Freight, FreightHealth, Rule, State
 from freights.serializers import FreightSerializer
 from test_data.freights.rule import create_rule
 from test_data.freights.state import create_state
@@ -69,6 +82,306 @@ class FreightHealthCheckAPITestCase(APITestCase):
         self.assertTrue(response.data['is_damaged'])
 
 
+class FreightDamageLevelTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight()
+        self.rules = [create_rule(freight=self.freight, possible_deviation=1) for i in range(3)]
+        for rule in self.rules:
+            for i in range(15):
+                create_state(limit_values=(rule.min_value - 1, rule.max_value + 1), rule=rule)
+
+    def test_damage_level_equals_reference(self):
+        self.assertAlmostEqual(self.freight.damage_level, self.freight.reference_damage_level)
+        self.assertAlmostEqual(self.freight.aggregated_damage_level, self.freight.reference_damage_level)
+
+    def test_damage_level_equals_reference_with_hard_violation(self):
+        rule = self.rules[0]
+        create_state(value=rule.max_value + rule.possible_deviation + 1, rule=rule)
+        self.assertAlmostEqual(self.freight.damage_level, self.freight.reference_damage_level)
+        self.assertAlmostEqual(self.freight.aggregated_damage_level, self.freight.reference_damage_level)
+
+    def test_damage_level_equals_reference_after_state_changes(self):
+        rule = self.rules[0]
+        state = rule.states.first()
+        state.value = rule.max_value + rule.possible_deviation + 1
+        state.save()
+        rule.states.last().delete()
+        self.assertAlmostEqual(self.freight.damage_level, self.freight.reference_damage_level)
+
+    def test_damage_level_number_of_queries(self):
+        with self.assertNumQueries(1):
+            self.freight.damage_level
+        with self.assertNumQueries(1):
+            self.freight.aggregated_damage_level
+
+
+class FreightHealthSummaryTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rules = [create_rule(freight=self.freight, possible_deviation=1) for i in range(3)]
+        for rule in self.rules:
+            for i in range(15):
+                create_state(limit_values=(rule.min_value - 1, rule.max_value + 1), rule=rule)
+        self.freight_list_url = reverse('freights:list')
+
+    def assertHealthIsRefreshed(self):
+        health = FreightHealth.objects.get(freight=self.freight)
+        rules = list(self.freight.rules.all())
+        damages = {rule: rule.coefficient * rule.weigh_anomaly_score(rule.counted_violation_probability)
+                   for rule in rules}
+
+        self.assertAlmostEqual(health.damage_level, self.freight.damage_level)
+        self.assertEqual(health.worst_rule, max(damages, key=damages.get) if any(damages.values()) else None)
+        self.assertEqual(health.states_count, sum(rule.states_count for rule in rules))
+        self.assertEqual(health.last_state_timestamp, max(rule.last_state_timestamp for rule in rules))
+
+    def test_health_is_refreshed_on_new_states(self):
+        rule = self.rules[0]
+        create_states([State(rule=rule, value=rule.max_value + rule.possible_deviation + 1)])
+
+        self.assertHealthIsRefreshed()
+
+    def test_health_is_refreshed_on_state_changes(self):
+        rule = self.rules[1]
+        state = rule.states.first()
+        state.value = rule.max_value + rule.possible_deviation + 1
+        state.save()
+        rule.states.last().delete()
+
+        self.assertHealthIsRefreshed()
+
+    def test_health_is_refreshed_on_rule_deletion(self):
+        rule_detail_url = reverse('freights:rule-detail', kwargs={'freight_pk': self.freight.id,
+                                                                  'rule_pk': self.rules[0].id})
+        self.client.delete(rule_detail_url)
+
+        self.assertHealthIsRefreshed()
+
+    def test_freight_list_with_health(self):
+        for i in range(5):
+            freight = create_freight(need_transfer=True)
+            create_state(rule=create_rule(freight=freight, device=create_device(min_value=0, max_value=100)))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.freight_list_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        health = {freight['id']: freight['health'] for freight in response.data['results']}
+        self.assertAlmostEqual(health[self.freight.id]['damage_level'], self.freight.damage_level)
+        self.assertEqual(health[self.freight.id]['states_count'], 45)
+
+
+class FreightWindowedHealthCheckAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight()
+        self.rule = create_rule(freight=self.freight, coefficient=0.5, possible_deviation=0,
+                                time_interval=timedelta(hours=1))
+        outdated_timestamp = timezone.now() - timedelta(hours=2)
+        for i in range(15):
+            create_state(value=self.rule.max_value + 1, timestamp=outdated_timestamp, rule=self.rule)
+            create_state(value=self.rule.min_value, rule=self.rule)
+
+        self.health_check_url = reverse('freights:check-health', kwargs={'pk': self.freight.id})
+
+    def test_windowed_damage_level_ignores_outdated_states(self):
+        self.assertEqual(self.freight.windowed_damage_level, 0)
+        self.assertEqual(self.freight.damage_level, 0.5)
+
+    def test_windowed_damage_level_counts_recent_states(self):
+        create_state(value=self.rule.max_value + 1, rule=self.rule)
+        self.assertEqual(self.freight.windowed_damage_level, 0.5)
+
+    def test_windowed_health_check(self):
+        response = self.client.post(f'{self.health_check_url}?windowed=true')
+        self.assertFalse(response.data['is_damaged'])
+
+        response = self.client.post(self.health_check_url)
+        self.assertTrue(response.data['is_damaged'])
+
+
+class FreightBulkHealthCheckAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.healthy_freight = create_freight(status=Freight.Status.IN_DELIVERY_TRANSIT)
+        self.damaged_freight = create_freight(status=Freight.Status.IN_RECEPTION_TRANSIT)
+        self.delivered_freight = create_freight(status=Freight.Status.DELIVERED)
+
+        for freight in [self.healthy_freight, self.damaged_freight, self.delivered_freight]:
+            rule = create_rule(freight=freight, coefficient=0.5, possible_deviation=0)
+            for i in range(15):
+                create_state(value=rule.min_value, rule=rule)
+
+            if freight != self.healthy_freight:
+                create_state(value=rule.max_value + 1, rule=rule)
+
+        self.bulk_health_check_url = reverse('freights:bulk-check-health')
+
+    def test_damage_levels_equal_freight_damage_level(self):
+        damage_levels = calculate_damage_levels(Freight.objects.all())
+
+        for freight in Freight.objects.all():
+            self.assertAlmostEqual(damage_levels[freight.id], freight.damage_level)
+
+    def test_bulk_health_check(self):
+        response = self.client.post(self.bulk_health_check_url)
+        self.delivered_freight.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['damaged_freights'], [self.damaged_freight.id])
+        self.assertFalse(self.delivered_freight.is_damaged)
+
+
+class FreightHealthEvaluationTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.healthy_freight = create_freight(status=Freight.Status.IN_DELIVERY_TRANSIT)
+        self.damaged_freight = create_freight(status=Freight.Status.IN_DELIVERY_TRANSIT)
+
+        for freight in [self.healthy_freight, self.damaged_freight]:
+            rule = create_rule(freight=freight, coefficient=0.5, possible_deviation=0)
+            for i in range(15):
+                create_state(value=rule.min_value, rule=rule)
+
+            if freight == self.damaged_freight:
+                create_state(value=rule.max_value + 1, rule=rule)
+
+        self.health_check_url = reverse('freights:check-health', kwargs={'pk': self.damaged_freight.id})
+
+    def test_new_states_mark_rules_unevaluated(self):
+        self.assertEqual(Rule.objects.filter(has_unevaluated_states=True).count(), 2)
+
+    def test_evaluation_marks_damaged_freights(self):
+        with HealthEvaluator() as evaluator:
+            freight_ids, damaged_freight_ids = evaluator.evaluate_once()
+
+        self.assertEqual(freight_ids, sorted([self.healthy_freight.id, self.damaged_freight.id]))
+        self.assertEqual(damaged_freight_ids, [self.damaged_freight.id])
+        self.assertFalse(Rule.objects.filter(has_unevaluated_states=True).exists())
+
+    def test_evaluation_skips_evaluated_freights(self):
+        with HealthEvaluator() as evaluator:
+            evaluator.evaluate_once()
+            rule = self.healthy_freight.rules.first()
+            create_state(value=rule.min_value, rule=rule)
+            freight_ids, damaged_freight_ids = evaluator.evaluate_once()
+
+        self.assertEqual(freight_ids, [self.healthy_freight.id])
+        self.assertEqual(damaged_freight_ids, [])
+
+    def test_health_check_reads_evaluated_health(self):
+        response = self.client.get(self.health_check_url)
+        self.assertFalse(response.data['is_damaged'])
+
+        with HealthEvaluator() as evaluator:
+            evaluator.evaluate_once()
+
+        response = self.client.get(self.health_check_url)
+        self.assertTrue(response.data['is_damaged'])
+
+
+class FreightEventsTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(status=Freight.Status.WAITING)
+        self.rule = create_rule(freight=self.freight, coefficient=0.5, possible_deviation=0)
+        for i in range(15):
+            create_state(value=self.rule.max_value + 1, rule=self.rule)
+
+    def test_changes_are_published_on_commit(self):
+        freight = Freight.objects.get(pk=self.freight.id)
+
+        with mock.patch('freight_terminal.events.broadcaster.publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                freight.name = fake.word()
+                freight.save()
+            publish.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                freight.status = Freight.Status.IN_DELIVERY_TRANSIT
+                freight.save()
+            publish.assert_called_once_with({'type': 'freight', 'id': freight.id,
+                                             'changes': {'status': Freight.Status.IN_DELIVERY_TRANSIT}})
+
+    def test_bulk_health_check_publishes_changes(self):
+        with mock.patch('freight_terminal.events.broadcaster.publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('freights:bulk-check-health'))
+                self.client.post(reverse('freights:bulk-check-health'))
+
+        publish.assert_called_once_with({'type': 'freight', 'id': self.freight.id, 'changes': {'is_damaged': True}})
+
+    def test_broadcaster_fans_out_events(self):
+        broadcaster = Broadcaster(queue_size=2)
+
+        async def receive_events():
+            queues = [broadcaster.subscribe(), broadcaster.subscribe()]
+            for i in range(3):
+                broadcaster.publish({'id': i})
+            await asyncio.sleep(0)
+            return [[queue.get_nowait()['id'] for i in range(queue.qsize())] for queue in queues]
+
+        self.assertEqual(asyncio.run(receive_events()), [[1, 2], [1, 2]])
+
+
+class FreightDamageForecastAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.now = timezone.now()
+        self.drifting_freight = create_freight(need_transfer=True, status=Freight.Status.IN_RECEPTION_TRANSIT)
+        self.steady_freight = create_freight(need_transfer=True, status=Freight.Status.IN_RECEPTION_TRANSIT)
+        self.delivered_freight = create_freight(need_transfer=True, status=Freight.Status.DELIVERED)
+
+        for freight in [self.drifting_freight, self.steady_freight, self.delivered_freight]:
+            reception_service = freight.transfer.reception_service
+            reception_service.arrival_datetime = self.now + timedelta(hours=2)
+            reception_service.save()
+
+            device = create_device(min_value=0, max_value=200)
+            rule = create_rule(freight=freight, device=device, min_value=0, max_value=60, coefficient=1,
+                               possible_deviation=100, time_interval=timedelta(hours=1))
+            for minutes in range(15):
+                value = 30 + minutes if freight == self.drifting_freight else 30
+                create_state(value=value, timestamp=self.now - timedelta(minutes=15 - minutes), rule=rule)
+
+        self.damage_forecast_url = reverse('freights:damage-forecast')
+
+    def test_drifting_freight_is_damaged_before_arrival(self):
+        forecasts = {forecast['freight']: forecast for forecast in forecast_damage(Freight.objects.all(), self.now)}
+        drifting_forecast = forecasts[self.drifting_freight.id]
+
+        self.assertEqual(drifting_forecast['damage_level'], 0)
+        self.assertTrue(drifting_forecast['damaged_before_arrival'])
+        self.assertGreater(drifting_forecast['damage_datetime'], self.now + timedelta(minutes=15))
+        self.assertLess(drifting_forecast['damage_datetime'], self.now + timedelta(hours=1))
+
+    def test_steady_freight_is_not_damaged(self):
+        forecasts = {forecast['freight']: forecast for forecast in forecast_damage(Freight.objects.all(), self.now)}
+        steady_forecast = forecasts[self.steady_freight.id]
+
+        self.assertIsNone(steady_forecast['damage_datetime'])
+        self.assertFalse(steady_forecast['damaged_before_arrival'])
+
+    def test_flat_out_of_limit_freight_violation_probability_is_not_exceeded(self):
+        freight = create_freight(need_transfer=True, status=Freight.Status.IN_RECEPTION_TRANSIT)
+        device = create_device(min_value=0, max_value=200)
+        rule = create_rule(freight=freight, device=device, min_value=0, max_value=60, coefficient=0.15,
+                           possible_deviation=100, time_interval=timedelta(hours=1))
+        # Rollup of the states is placed in the middle of their minute, which is now, so the trend is exactly flat
+        now = self.now.replace(second=30, microsecond=0)
+        for i in range(15):
+            create_state(value=70, timestamp=now - timedelta(seconds=30), rule=rule)
+
+        forecast, = forecast_damage(Freight.objects.filter(pk=freight.pk), now)
+
+        # Damage level stays at the coefficient of the rule, as the projected violation probability stays 1
+        self.assertAlmostEqual(forecast['damage_level'], 0.15)
+        self.assertIsNone(forecast['damage_datetime'])
+
+    def test_damage_forecast(self):
+        response = self.client.get(self.damage_forecast_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([forecast['freight'] for forecast in response.data],
+                         [self.drifting_freight.id, self.steady_freight.id])
+        self.assertTrue(response.data[0]['damaged_before_arrival'])
+
+
 class GetFreightAPITestCase(APITestCase):
     def setUp(self) -> None:
         self.freight = create_freight(need_transfer=True)
@@ -156,3 +469,85 @@ class DeleteFreightAPITestCase(APITestCase):
     def test_invalid_freight_delete(self):
         response = self.client.delete(self.invalid_freight_detail_url, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ReturnFreightAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True, status=Freight.Status.IN_DELIVERY_TRANSIT)
+        Service.objects.filter(pk__in=[self.freight.transfer.delivery_service_id,
+                                       self.freight.transfer.reception_service_id]).update(
+            status=Service.Status.IN_TRANSIT_WITH_FREIGHT)
+        self.freight_return_url = reverse('freights:return', kwargs={'pk': self.freight.id})
+
+    def test_freight_return(self):
+        response = self.client.post(self.freight_return_url)
+        self.freight.refresh_from_db()
+        self.freight.transfer.delivery_service.refresh_from_db()
+        self.freight.transfer.reception_service.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.freight.status, Freight.Status.RETURNING)
+        self.assertEqual(self.freight.transfer.delivery_service.status, Service.Status.RETURNING_FREIGHT)
+        self.assertEqual(self.freight.transfer.reception_service.status, Service.Status.RETURNING_FREIGHT)
+
+    def test_returning_freight_return(self):
+        self.client.post(self.freight_return_url)
+        response = self.client.post(self.freight_return_url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'Freight is already on his way to be returned')
+
+    def test_freight_return_is_atomic(self):
+        Service.objects.filter(pk=self.freight.transfer.reception_service_id).update(
+            status=Service.Status.RETURNED_FREIGHT)
+
+        response = self.client.post(self.freight_return_url)
+        self.freight.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.freight.status, Freight.Status.IN_DELIVERY_TRANSIT)
+        self.assertEqual(Service.objects.get(pk=self.freight.transfer.delivery_service_id).status,
+                         Service.Status.IN_TRANSIT_WITH_FREIGHT)
+
+
+class FreightBulkReturnAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freights = [create_freight(need_transfer=True, status=Freight.Status.IN_RECEPTION_TRANSIT)
+                         for i in range(3)]
+        self.returned_freight = create_freight(need_transfer=True, status=Freight.Status.RETURNED)
+        self.freight_without_transfer = create_freight(status=Freight.Status.NOT_ASSIGNED)
+        self.service_ids = [service_id for freight in [*self.freights, self.returned_freight]
+                            for service_id in [freight.transfer.delivery_service_id,
+                                               freight.transfer.reception_service_id]]
+        Service.objects.filter(pk__in=self.service_ids).update(status=Service.Status.IN_TRANSIT_WITH_FREIGHT)
+
+        self.bulk_return_url = reverse('freights:bulk-return')
+
+    def test_freight_bulk_return(self):
+        freight_ids = [freight.id for freight in self.freights]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.bulk_return_url, {'freights': freight_ids}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'returned': freight_ids, 'errors': []})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 2)
+        self.assertEqual(Freight.objects.filter(status=Freight.Status.RETURNING).count(), 3)
+        self.assertEqual(Service.objects.filter(status=Service.Status.RETURNING_FREIGHT).count(), 6)
+
+    def test_freight_bulk_return_with_errors(self):
+        freight_ids = [self.freights[0].id, self.returned_freight.id, self.freight_without_transfer.id, 1000000]
+        response = self.client.post(self.bulk_return_url, {'freights': freight_ids}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['returned'], [self.freights[0].id])
+        self.assertEqual(response.data['errors'], [
+            {'freight': self.returned_freight.id, 'errors': ['Freight is already on his way to be returned']},
+            {'freight': self.freight_without_transfer.id, 'errors': ['Transfer is not assigned to the freight']},
+            {'freight': 1000000, 'errors': ['Freight does not exist']},
+        ])
+        self.assertEqual(Service.objects.filter(status=Service.Status.RETURNING_FREIGHT).count(), 2)
+
+    def test_invalid_freight_bulk_return(self):
+        response = self.client.post(self.bulk_return_url, {'freights': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,15 +1,24 @@
+from io import StringIO
 from math import floor, ceil
 from datetime import timedelta
+from unittest import mock
 
+from django.core.management import call_command
+from django.db.models import F
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from test_data import fake
 from test_data.freights.rule import create_rule
 from test_data.freights.freight import create_freight
+from test_data.freights.state import create_state
 from test_data.devices.device import create_device
-from freights.models import Rule
+from freights.health import calculate_damage_levels
+from freights.ingestion import create_states
+from freights.models import Freight, Rule, State, StateRollup
 from freights.serializers import RuleSerializer
 
 
@@ -126,6 +135,15 @@ class UpdateRuleAPITestCase(APITestCase):
         response = self.client.patch(self.rule_detail_url, self.invalid_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_rule_update_keeps_concurrently_changed_counters(self):
+        serializer = RuleSerializer(self.rule, data={'coefficient': 0.5}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        Rule.objects.filter(pk=self.rule.pk).update(states_count=F('states_count') + 5, ewma_value=1)
+        serializer.save()
+        self.rule.refresh_from_db()
+
+        self.assertEqual((self.rule.coefficient, self.rule.states_count, self.rule.ewma_value), (0.5, 5, 1))
+
 
 class DeleteRuleAPITestCase(APITestCase):
     def setUp(self) -> None:
@@ -144,3 +162,103 @@ class DeleteRuleAPITestCase(APITestCase):
     def test_invalid_rule_delete(self):
         response = self.client.delete(self.invalid_rule_detail_url, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecomputeRuleStateCountersAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.device = create_device()
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(device=self.device, freight=self.freight, possible_deviation=0)
+        for i in range(5):
+            create_state(value=self.rule.max_value, rule=self.rule)
+
+        self.rule_detail_url = reverse('freights:rule-detail', kwargs={'freight_pk': self.freight.id,
+                                                                       'rule_pk': self.rule.id})
+
+    def test_counters_recomputed_on_limits_update(self):
+        new_max_value = (self.rule.min_value + self.rule.max_value) / 2
+        response = self.client.patch(self.rule_detail_url, {'max_value': new_max_value}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['states_count'], 5)
+        self.assertEqual(response.data['out_of_limit_states_count'], 5)
+        self.assertEqual(response.data['hard_violations_count'], 5)
+
+    def test_limits_update_is_rolled_back_on_failure(self):
+        new_max_value = (self.rule.min_value + self.rule.max_value) / 2
+
+        with mock.patch.object(StateRollup.objects, 'rebuild', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.patch(self.rule_detail_url, {'max_value': new_max_value}, format='json')
+
+        rule = Rule.objects.get(pk=self.rule.pk)
+        self.assertEqual((rule.max_value, rule.out_of_limit_states_count), (self.rule.max_value, 0))
+
+    def test_recompute_command(self):
+        Rule.objects.filter(pk=self.rule.pk).update(states_count=0)
+        call_command('recompute_rule_counters', rule=[self.rule.pk], stdout=StringIO())
+        self.rule.refresh_from_db()
+
+        self.assertEqual(self.rule.states_count, 5)
+        self.assertEqual(self.rule.out_of_limit_states_count, 0)
+
+
+class RuleStreamingStatsTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.device = create_device(min_value=-100, max_value=100)
+        self.rule = create_rule(device=self.device, min_value=0, max_value=60, coefficient=0.5,
+                                time_interval=timedelta(hours=1))
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def create_states(self, values):
+        for minutes, value in enumerate(values):
+            create_state(value=value, timestamp=self.start + timedelta(minutes=minutes), rule=self.rule)
+        self.rule.refresh_from_db()
+
+    def test_steady_values_are_not_anomalous(self):
+        self.create_states([20] * 15)
+
+        self.assertEqual(self.rule.ewma_value, 20)
+        self.assertEqual(self.rule.ewma_rate, 0)
+        self.assertEqual(self.rule.anomaly_score, 0)
+
+    def test_drift_within_limits_is_anomalous(self):
+        self.create_states(range(0, 45, 3))
+
+        self.assertEqual(self.rule.out_of_limit_states_count, 0)
+        self.assertGreater(self.rule.ewma_rate, 0)
+        self.assertEqual(self.rule.anomaly_score, 1)
+
+    def test_spike_within_limits_is_anomalous(self):
+        self.create_states([20, 21] * 10)
+        self.assertLess(self.rule.anomaly_score, 1)
+
+        self.create_states([50])
+        self.assertEqual(self.rule.anomaly_score, 1)
+
+    def test_bulk_creation_and_rebuild_give_same_stats(self):
+        self.create_states([20, 25, 22, 30, 28, 35])
+        expected_stats = [getattr(self.rule, field) for field in Rule.STREAMING_STATS_FIELDS]
+
+        other_rule = create_rule(device=self.device, min_value=0, max_value=60, time_interval=timedelta(hours=1))
+        create_states([State(rule=other_rule, value=state.value, timestamp=state.timestamp)
+                       for state in self.rule.states.order_by('-timestamp')])
+        other_rule.refresh_from_db()
+
+        Rule.objects.filter(pk=self.rule.pk).rebuild_streaming_stats()
+        self.rule.refresh_from_db()
+
+        for field, expected_value in zip(Rule.STREAMING_STATS_FIELDS, expected_stats):
+            self.assertAlmostEqual(getattr(other_rule, field), expected_value)
+            self.assertAlmostEqual(getattr(self.rule, field), expected_value)
+
+    def test_anomaly_score_weight_in_damage_level(self):
+        self.create_states(range(0, 45, 3))
+        freight = self.rule.freight
+
+        self.assertEqual(freight.damage_level, 0)
+
+        with override_settings(ANOMALY_SCORE_WEIGHT=0.5):
+            self.assertEqual(freight.damage_level, 0.25)
+            self.assertAlmostEqual(freight.aggregated_damage_level, 0.25)
+            self.assertAlmostEqual(calculate_damage_levels(Freight.objects.all())[freight.id], 0.25)
@@ -1,15 +1,54 @@
+import asyncio
+import csv
+import gzip
+import json
+import re
+from datetime import timedelta
 from math import floor, ceil
+from unittest import mock
 
+from asgiref.sync import async_to_sync
+from django.core.exceptions import SynchronousOnlyOperation
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from test_data import fake
 from test_data.freights.rule import create_rule
 from test_data.freights.state import create_state
 from test_data.freights.freight import create_freight
-from freights.models import State
+from freights.binary import FRAME_MAGIC, decode_frame, encode_frame
+from freights import ingestion
+from freights.buffering import WriteBehindBuffer
+from freights.ingestion import create_states, validate_readings
+from freights.models import State, StateRollup
 from freights.serializers import StateSerializer
+from freight_terminal.asgi import application
+
+
+async def serve(application, method, path, body=b''):
+    """
+    Serve one request with the ASGI application and return messages it sent.
+    """
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')]}
+    await application(scope, receive, send)
+    return messages
 
 
 class CreateNewStateAPITestCase(APITestCase):
@@ -45,6 +84,63 @@ class CreateNewStateAPITestCase(APITestCase):
         response = self.client.post(self.state_list_url, self.invalid_state, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_state_creation_queries(self):
+        # The first state creates rollup buckets and health summary, the second one only updates them
+        state = {**self.valid_state, 'timestamp': timezone.now()}
+        self.client.post(self.state_list_url, state, format='json')
+
+        # Rule read, savepoint, state insert, rule lock and update, two rollup updates, summary lock, rules read,
+        # summary update and savepoint release
+        with self.assertNumQueries(11):
+            response = self.client.post(self.state_list_url, state, format='json')
+
+        self.rule.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((self.rule.states_count, self.rule.out_of_limit_states_count), (2, 0))
+        self.assertEqual(self.rule.ewma_value, state['value'])
+
+
+class ListStateAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(freight=self.freight)
+        self.states = [create_state(rule=self.rule) for i in range(3)]
+        self.state_list_url = reverse('freights:state-list', kwargs={'freight_pk': self.freight.id,
+                                                                     'rule_pk': self.rule.id})
+
+    def test_state_list_pagination(self):
+        first_page = self.client.get(self.state_list_url, {'page_size': 2})
+        second_page = self.client.get(first_page.data['next'])
+        states = first_page.data['results'] + second_page.data['results']
+
+        self.assertEqual(first_page.status_code, status.HTTP_200_OK)
+        self.assertEqual(second_page.status_code, status.HTTP_200_OK)
+        self.assertIsNone(second_page.data['next'])
+        self.assertEqual(states, StateSerializer(self.states, many=True).data)
+
+    def test_state_list_pagination_of_states_with_same_timestamp(self):
+        create_states([State(rule=self.rule, value=self.rule.min_value, timestamp=self.states[0].timestamp)
+                       for i in range(4)])
+        states = State.objects.filter(rule=self.rule).order_by('timestamp', 'id')
+        pages = [self.client.get(self.state_list_url, {'page_size': 2})]
+
+        with CaptureQueriesContext(connection) as queries:
+            while pages[-1].data['next']:
+                pages.append(self.client.get(pages[-1].data['next']))
+            previous_page = self.client.get(pages[-1].data['previous'])
+
+        self.assertEqual([state for page in pages for state in page.data['results']],
+                         StateSerializer(states, many=True).data)
+        self.assertEqual(previous_page.data['results'], pages[-2].data['results'])
+        self.assertFalse([query for query in queries.captured_queries if 'OFFSET' in query['sql']])
+
+    def test_state_list_timestamp_filter(self):
+        response = self.client.get(self.state_list_url, {'since': self.states[1].timestamp.isoformat(),
+                                                         'until': self.states[2].timestamp.isoformat()})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], StateSerializer(self.states[1:2], many=True).data)
+
 
 class GetStateAPITestCase(APITestCase):
     def setUp(self) -> None:
@@ -136,4 +232,366 @@ class DeleteStateAPITestCase(APITestCase):
 
     def test_invalid_state_delete(self):
         response = self.client.delete(self.invalid_state_detail_url, format='json')
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BulkCreateStateAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.rules = [create_rule(), create_rule()]
+        self.valid_readings = [
+            {
+                'rule': rule.id,
+                'value': fake.pyfloat(right_digits=2, min_value=ceil(rule.device.min_value),
+                                      max_value=floor(rule.device.max_value)),
+                'timestamp': fake.iso8601(tzinfo=timezone.utc),
+            }
+            for rule in self.rules for i in range(5)
+        ]
+        not_existing_rule = 10000000
+        valid_value = self.valid_readings[0]['value']
+        self.invalid_readings = [
+            {'rule': not_existing_rule, 'value': valid_value},
+            {'rule': self.rules[0].id, 'value': fake.pyfloat(min_value=ceil(self.rules[0].device.max_value) + 1)},
+            {'rule': self.rules[0].id, 'value': valid_value, 'timestamp': 'not valid datetime'},
+            {'rule': [self.rules[0].id], 'value': valid_value},
+            {'rule': {}, 'value': valid_value},
+            {'rule': self.rules[0].id, 'value': 10 ** 400},
+        ]
+        self.state_bulk_create_url = reverse('freights:state-bulk-create')
+
+    def test_valid_states_bulk_creation(self):
+        response = self.client.post(self.state_bulk_create_url, self.valid_readings, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 10, 'errors': []})
+        for rule in self.rules:
+            rule.refresh_from_db()
+            self.assertEqual(rule.states.count(), 5)
+            self.assertEqual(rule.states_count, 5)
+
+    def test_invalid_states_bulk_creation(self):
+        response = self.client.post(self.state_bulk_create_url, self.valid_readings + self.invalid_readings,
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 10)
+        self.assertEqual([error['index'] for error in response.data['errors']], [10, 11, 12, 13, 14, 15])
+        self.assertEqual([list(error['errors']) for error in response.data['errors']],
+                         [['rule'], ['value'], ['timestamp'], ['rule'], ['rule'], ['value']])
+
+    def test_readings_validation_number_of_queries(self):
+        validate_readings(self.valid_readings)
+
+        with self.assertNumQueries(1):
+            states, errors = validate_readings(self.valid_readings)
+
+        self.assertEqual(len(states), 10)
+
+    def test_rule_rows_are_locked_in_order_of_ids(self):
+        states, errors = validate_readings(self.valid_readings[::-1])
+
+        with CaptureQueriesContext(connection) as queries:
+            create_states(states)
+
+        updated_rule_ids = [int(re.search(r'"freights_rule"\."id" = (\d+)', query['sql']).group(1))
+                            for query in queries.captured_queries if query['sql'].startswith('UPDATE "freights_rule"')]
+        self.assertEqual(updated_rule_ids, sorted(updated_rule_ids))
+        self.assertEqual(set(updated_rule_ids), {rule.id for rule in self.rules})
+
+    def test_not_list_states_bulk_creation(self):
+        response = self.client.post(self.state_bulk_create_url, self.valid_readings[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BinaryBulkCreateStateAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.rule = create_rule()
+        self.timestamp = timezone.now().replace(microsecond=123456)
+        self.readings = [(self.rule.id, self.timestamp, self.rule.device.min_value), (self.rule.id, None, 0.5)]
+        self.state_binary_bulk_create_url = reverse('freights:state-binary-bulk-create')
+
+    def post_frame(self, frame):
+        return self.client.post(self.state_binary_bulk_create_url, frame, content_type='application/octet-stream')
+
+    def test_frame_encoding(self):
+        records = decode_frame(encode_frame(self.readings))
+
+        self.assertEqual(records[0], (self.rule.id, int(self.timestamp.timestamp()) * 10 ** 6 + 123456,
+                                      self.rule.device.min_value))
+        self.assertEqual(records[1], (self.rule.id, 0, 0.5))
+
+    def test_valid_states_binary_bulk_creation(self):
+        response = self.post_frame(encode_frame(self.readings[:1]))
+        state = self.rule.states.get()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 1, 'errors': []})
+        self.assertEqual(state.timestamp, self.timestamp)
+        self.assertEqual(state.value, self.rule.device.min_value)
+
+    def test_invalid_states_binary_bulk_creation(self):
+        invalid_readings = [(10000000, None, self.rule.device.min_value),
+                            (self.rule.id, None, self.rule.device.max_value + 1),
+                            (self.rule.id, None, float('nan'))]
+        response = self.post_frame(encode_frame(self.readings[:1] + invalid_readings))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertEqual(list(response.data['errors'][0]['errors']), ['rule'])
+        self.assertEqual(list(response.data['errors'][1]['errors']), ['value'])
+        self.assertEqual(list(response.data['errors'][2]['errors']), ['value'])
+
+    def test_malformed_frame(self):
+        response = self.post_frame(encode_frame(self.readings)[:-1])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.post_frame(b'JSON' + encode_frame(self.readings)[len(FRAME_MAGIC):])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WriteBehindBufferTestCase(APITestCase):
+    def setUp(self) -> None:
+        self.written = []
+
+    def test_buffer_is_written_when_full(self):
+        buffer = WriteBehindBuffer(self.written.append, interval=60, max_size=3)
+        first_written = buffer.add([1, 2])
+        second_written = buffer.add([3])
+
+        second_written.result(timeout=5)
+        self.assertTrue(first_written.done())
+        self.assertEqual(self.written, [[1, 2, 3]])
+        buffer.close()
+
+    def test_buffer_is_written_after_interval(self):
+        buffer = WriteBehindBuffer(self.written.append, interval=0.01, max_size=100)
+        buffer.add([1]).result(timeout=5)
+        buffer.add([2]).result(timeout=5)
+
+        self.assertEqual(self.written, [[1], [2]])
+        buffer.close()
+
+    def test_failed_write_fails_only_failing_adds(self):
+        def write(objects):
+            if 'bad' in objects:
+                raise ValueError
+            self.written.append(objects)
+
+        buffer = WriteBehindBuffer(write, interval=60, max_size=4)
+        with self.assertLogs('freights.buffering', level='WARNING'):
+            first_written, failed, last_written = buffer.add([1]), buffer.add(['bad']), buffer.add([2, 3])
+            last_written.result(timeout=5)
+        self.assertIsNone(first_written.result())
+        self.assertIsInstance(failed.exception(), ValueError)
+        self.assertEqual(self.written, [[1], [2, 3]])
+        buffer.close()
+
+    def test_empty_add_is_resolved(self):
+        buffer = WriteBehindBuffer(self.written.append, interval=0.01, max_size=100)
+        buffer.add([]).result(timeout=5)
+        buffer.close()
+
+    def test_buffer_is_written_on_close(self):
+        buffer = WriteBehindBuffer(self.written.append, interval=60, max_size=100)
+        written = buffer.add([1])
+        buffer.close()
+
+        self.assertTrue(written.done())
+        self.assertEqual(self.written, [[1]])
+        with self.assertRaises(RuntimeError):
+            buffer.add([2])
+
+
+@override_settings(STATE_WRITE_BEHIND=True, STATE_WRITE_BEHIND_INTERVAL=10)
+class WriteBehindStateAPITestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(freight=self.freight)
+        self.readings = [{'rule': self.rule.id, 'value': self.rule.device.min_value} for i in range(5)]
+        self.state_list_url = reverse('freights:state-list', kwargs={'freight_pk': self.freight.id,
+                                                                     'rule_pk': self.rule.id})
+
+        patcher = mock.patch.object(ingestion, '_state_write_buffer', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        ingestion.get_state_write_buffer().close()
+
+    def test_states_are_acknowledged_after_flush(self):
+        response = self.client.post(reverse('freights:state-bulk-create'), self.readings, format='json')
+        self.rule.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.rule.states.count(), 5)
+        self.assertEqual(self.rule.states_count, 5)
+        self.assertIsNone(ingestion.get_state_write_buffer()._thread)
+
+    @override_settings(STATE_WRITE_BEHIND_INTERVAL=10000, STATE_WRITE_BEHIND_MAX_ROWS=15)
+    def test_concurrent_async_requests_are_written_in_one_batch(self):
+        body = json.dumps(self.readings).encode()
+        path = reverse('freights:async-state-bulk-create')
+
+        async def post_concurrently():
+            return await asyncio.gather(*[serve(application, 'POST', path, body) for i in range(3)])
+
+        with mock.patch.object(ingestion, 'create_states', wraps=ingestion.create_states) as create_states:
+            responses = async_to_sync(post_concurrently)()
+
+        self.assertEqual([messages[0]['status'] for messages in responses], [status.HTTP_201_CREATED] * 3)
+        self.assertEqual([len(call.args[0]) for call in create_states.call_args_list], [15])
+        self.assertEqual(self.rule.states.count(), 15)
+
+    @override_settings(STATE_WRITE_BEHIND_ACK=ingestion.WRITE_BEHIND_ACK_ON_BUFFER)
+    def test_states_are_acknowledged_on_buffer(self):
+        response = self.client.post(self.state_list_url, self.readings[0], format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        ingestion.get_state_write_buffer().close()
+        self.assertEqual(self.rule.states.count(), 1)
+
+
+class AsyncBulkCreateStateAPITestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight()
+        self.rule = create_rule(freight=self.freight)
+        self.readings = [{'rule': self.rule.id, 'value': self.rule.device.min_value} for i in range(5)]
+        self.state_bulk_create_url = reverse('freights:async-state-bulk-create')
+        self.health_check_url = reverse('freights:async-check-health', kwargs={'pk': self.freight.id})
+
+    def test_valid_states_bulk_creation(self):
+        response = self.client.post(self.state_bulk_create_url, self.readings + [{'rule': self.rule.id}],
+                                    format='json')
+        self.rule.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['created'], 5)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [5])
+        self.assertEqual(self.rule.states_count, 5)
+
+    def test_invalid_states_bulk_creation(self):
+        response = self.client.post(self.state_bulk_create_url, {'rule': self.rule.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.state_bulk_create_url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_health_check(self):
+        response = self.client.get(self.health_check_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'is_damaged': False})
+
+        response = self.client.get(reverse('freights:async-check-health', kwargs={'pk': self.freight.id + 1}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_middleware_does_not_serialize_async_views(self):
+        for middleware in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(middleware), 'async_capable', False), middleware)
+
+
+class StateRollupAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(freight=self.freight)
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        self.states = [
+            create_state(value=value, timestamp=self.hour + timedelta(seconds=seconds), rule=self.rule)
+            for value, seconds in [(1, 1), (2, 2), (6, 120), (10, 3601)]
+        ]
+        self.state_rollup_list_url = reverse('freights:state-rollup-list', kwargs={'freight_pk': self.freight.id,
+                                                                                   'rule_pk': self.rule.id})
+
+    def test_hourly_rollups(self):
+        response = self.client.get(self.state_rollup_list_url, {'resolution': StateRollup.Resolution.HOUR})
+        rollups = response.data['results']
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(rollups), 2)
+        self.assertEqual((rollups[0]['min_value'], rollups[0]['max_value'], rollups[0]['mean_value']), (1, 6, 3))
+        self.assertEqual(rollups[0]['count'], 3)
+        self.assertEqual(rollups[1]['count'], 1)
+
+    def test_minute_rollups_after_state_delete(self):
+        self.states[1].delete()
+        response = self.client.get(self.state_rollup_list_url, {'resolution': StateRollup.Resolution.MINUTE,
+                                                                 'until': self.hour + timedelta(hours=1)})
+        rollups = response.data['results']
+
+        self.assertEqual([(rollup['min_value'], rollup['count']) for rollup in rollups], [(1, 1), (6, 1)])
+
+    def test_rollups_equal_rebuilt_rollups(self):
+        create_states([State(value=value, timestamp=self.hour + timedelta(seconds=5), rule=self.rule)
+                       for value in [0, 20]])
+        rollups = list(StateRollup.objects.order_by('resolution', 'bucket').values())
+        StateRollup.objects.rebuild([self.rule])
+        rebuilt_rollups = list(StateRollup.objects.order_by('resolution', 'bucket').values())
+
+        self.assertEqual([{**rollup, 'id': None} for rollup in rollups],
+                         [{**rollup, 'id': None} for rollup in rebuilt_rollups])
+
+    def test_failed_rebuild_keeps_rollups(self):
+        rollups = list(StateRollup.objects.order_by('resolution', 'bucket').values())
+
+        with mock.patch('freights.managers.StateRollupQuerySet.bulk_create', side_effect=[[], RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                StateRollup.objects.rebuild([self.rule])
+
+        self.assertEqual(list(StateRollup.objects.order_by('resolution', 'bucket').values()), rollups)
+
+    def test_invalid_resolution(self):
+        response = self.client.get(self.state_rollup_list_url, {'resolution': 'day'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StateExportAPITestCase(APITestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(freight=self.freight)
+        self.other_rule = create_rule(freight=self.freight)
+        self.states = [create_state(rule=rule) for rule in [self.rule, self.rule, self.other_rule]]
+
+        self.state_export_url = reverse('freights:state-export', kwargs={'freight_pk': self.freight.id})
+        self.rule_state_export_url = reverse('freights:rule-state-export', kwargs={'freight_pk': self.freight.id,
+                                                                                   'rule_pk': self.rule.id})
+
+    def test_ndjson_export(self):
+        response = self.client.get(self.state_export_url)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in lines], [state.id for state in self.states])
+
+    def test_gzip_csv_export(self):
+        response = self.client.get(self.rule_state_export_url, {'file_format': 'csv', 'gzip': 'true'})
+        rows = list(csv.reader(gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(rows[0], ['id', 'rule', 'timestamp', 'value'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [state.id for state in self.states[:2]])
+
+    def test_invalid_file_format_export(self):
+        response = self.client.get(self.state_export_url, {'file_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ASGIStateExportTestCase(APITransactionTestCase):
+    def setUp(self) -> None:
+        self.freight = create_freight(need_transfer=True)
+        self.rule = create_rule(freight=self.freight)
+        self.states = [create_state(rule=self.rule) for i in range(3)]
+        self.state_export_url = reverse('freights:state-export', kwargs={'freight_pk': self.freight.id})
+
+    def test_export_is_streamed_by_asgi_application(self):
+        messages = async_to_sync(serve)(application, 'GET', self.state_export_url)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        self.assertEqual([json.loads(line)['id'] for line in body.decode().splitlines()],
+                         [state.id for state in self.states])
+
+    def test_export_is_not_streamed_by_default_asgi_handler(self):
+        with self.assertRaises(SynchronousOnlyOperation):
+            async_to_sync(serve)(ASGIHandler(), 'GET', self.state_export_url)
@@ -1,14 +1,18 @@
 from django.urls import path
 
-from freights import views
+from freights import async_views, views
 
 app_name = 'freights'
 
 urlpatterns = [
     # Freight
     path('', views.FreightListCreateAPIView.as_view(), name='list'),
+    path('check-health/', views.FreightBulkHealthCheckAPIView.as_view(), name='bulk-check-health'),
+    path('return/', views.FreightBulkReturnAPIView.as_view(), name='bulk-return'),
+    path('damage-forecast/', views.FreightDamageForecastAPIView.as_view(), name='damage-forecast'),
     path('<int:pk>/', views.FreightRetrieveUpdateDestroyAPIView.as_view(), name='detail'),
     path('<int:pk>/check-health/', views.FreightHealthCheckAPIView.as_view(), name='check-health'),
+    path('<int:pk>/check-health/async/', async_views.freight_health, name='async-check-health'),
     path('<int:pk>/return/', views.ReturnFreightAPIView.as_view(), name='return'),
 
     # Rule
@@ -16,7 +20,15 @@ urlpatterns = [
     path('<int:freight_pk>/rules/<int:rule_pk>/', views.RuleRetrieveUpdateDestroyAPIView.as_view(), name='rule-detail'),
 
     # State
+    path('states/', views.StateBulkCreateAPIView.as_view(), name='state-bulk-create'),
+    path('states/async/', async_views.state_bulk_create, name='async-state-bulk-create'),
+    path('states/binary/', views.StateBinaryBulkCreateAPIView.as_view(), name='state-binary-bulk-create'),
+    path('<int:freight_pk>/states/export/', views.StateExportAPIView.as_view(), name='state-export'),
     path('<int:freight_pk>/rules/<int:rule_pk>/states/', views.StateListCreateAPIView.as_view(), name='state-list'),
+    path('<int:freight_pk>/rules/<int:rule_pk>/states/rollups/', views.StateRollupListAPIView.as_view(),
+         name='state-rollup-list'),
+    path('<int:freight_pk>/rules/<int:rule_pk>/states/export/', views.StateExportAPIView.as_view(),
+         name='rule-state-export'),
     path('<int:freight_pk>/rules/<int:rule_pk>/states/<int:state_pk>/',
          views.StateRetrieveUpdateDestroyAPIView.as_view(),
          name='state-detail'),
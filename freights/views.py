@@ -1,31 +1,61 @@
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from rest_framework import generics
 from rest_framework import views
 from rest_framework import status
 from rest_framework.response import Response
 
-from freights.models import Freight, Rule, State
-from freights.serializers import FreightSerializer, RuleSerializer, StateSerializer
+from freight_terminal.events import publish_changes
+from freight_terminal.transitions import TransitionError
+from freights.export import RENDERERS, export_states
+from freights.forecast import forecast_damage
+from freights.health import mark_damaged_freights
+from freights.ingestion import acknowledges_on_buffer, get_batch_error, ingest_readings, ingest_records, store_states
+from freights.models import Freight, FreightHealth, Rule, State, StateRollup
+from freights.parsers import StateFrameParser
+from freights.returns import start_freight_returns
+from freights.serializers import (FreightReturnSerializer, FreightSerializer, RuleSerializer, StateSerializer,
+                                  StateFilterSerializer, StateRollupSerializer, StateRollupFilterSerializer)
 
 
 class FreightListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Freight.objects.all()
+    queryset = Freight.objects.select_related('transfer', 'health')
     serializer_class = FreightSerializer
 
 
 class FreightRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Freight.objects.all()
+    queryset = Freight.objects.select_related('transfer', 'health')
     serializer_class = FreightSerializer
 
 
 class FreightHealthCheckAPIView(views.APIView):
+    def get(self, request, pk=None):
+        freight = generics.get_object_or_404(Freight, pk=pk)
+        return Response({'is_damaged': freight.is_damaged})
+
     def post(self, request, pk=None):
         freight = generics.get_object_or_404(Freight, pk=pk)
-        if freight.damage_level > freight.DAMAGE_THRESHOLD_VALUE:
+        windowed = request.query_params.get('windowed', '').lower() in ['true', '1']
+        damage_level = freight.windowed_damage_level if windowed else freight.damage_level
+
+        if damage_level > freight.DAMAGE_THRESHOLD_VALUE:
+            if Freight.objects.filter(pk=freight.pk, is_damaged=False).update(is_damaged=True):
+                publish_changes(Freight, freight.pk, {'is_damaged': True})
             freight.is_damaged = True
-            freight.save()
         return Response({'is_damaged': freight.is_damaged})
 
 
+class FreightBulkHealthCheckAPIView(views.APIView):
+    def post(self, request):
+        damaged_freight_ids = mark_damaged_freights(Freight.objects.active())
+        return Response({'damaged_freights': damaged_freight_ids})
+
+
+class FreightDamageForecastAPIView(views.APIView):
+    def get(self, request):
+        return Response(forecast_damage(Freight.objects.active()))
+
+
 class ReturnFreightAPIView(views.APIView):
     def post(self, request, pk=None):
         freight = generics.get_object_or_404(Freight, pk=pk)
@@ -34,12 +64,23 @@ class ReturnFreightAPIView(views.APIView):
             return Response(data={'detail': 'Transfer is not assigned to the freight'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        if freight.status not in [Freight.Status.RETURNING, Freight.Status.RETURNED]:
+        try:
             freight.start_return()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        except TransitionError:
+            return Response(data={'detail': 'Freight is already on his way to be returned'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-        return Response(data={'detail': 'Freight is already on his way to be returned'},
-                        status=status.HTTP_400_BAD_REQUEST)
+class FreightBulkReturnAPIView(views.APIView):
+    def post(self, request):
+        serializer = FreightReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        returned, errors = start_freight_returns(serializer.validated_data['freights'])
+
+        return Response(data={'returned': returned, 'errors': errors})
 
 
 class RuleListCreateAPIView(generics.ListCreateAPIView):
@@ -61,14 +102,70 @@ class RuleRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         freight = generics.get_object_or_404(Freight, pk=self.kwargs['freight_pk'])
         return generics.get_object_or_404(Rule, pk=self.kwargs['rule_pk'], freight=freight)
 
+    def perform_update(self, serializer):
+        limits = ['min_value', 'max_value', 'possible_deviation']
+        previous_limits = [getattr(serializer.instance, limit) for limit in limits]
+        previous_freight_id = serializer.instance.freight_id
+
+        with transaction.atomic():
+            rule = serializer.save()
+
+            if previous_limits != [getattr(rule, limit) for limit in limits]:
+                Rule.objects.filter(pk=rule.pk).recompute_state_counters()
+                StateRollup.objects.rebuild([rule])
+                rule.refresh_from_db()
+
+            FreightHealth.objects.refresh({previous_freight_id, rule.freight_id})
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        FreightHealth.objects.refresh([instance.freight_id])
+
+
+def get_created_status():
+    """
+    Return status of responses to requests creating states, which are only accepted if they are not written yet.
+    """
+    return status.HTTP_202_ACCEPTED if acknowledges_on_buffer() else status.HTTP_201_CREATED
+
+
+def filter_states_by_timestamp(states, query_params):
+    """
+    Filter states by optional `since` and `until` query parameters.
+
+    Bounds on timestamp let PostgreSQL skip partitions of states table which are out of them.
+    """
+    filter_serializer = StateFilterSerializer(data=query_params)
+    filter_serializer.is_valid(raise_exception=True)
+    filters = filter_serializer.validated_data
+
+    if 'since' in filters:
+        states = states.filter(timestamp__gte=filters['since'])
+    if 'until' in filters:
+        states = states.filter(timestamp__lt=filters['until'])
+
+    return states
+
 
 class StateListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = StateSerializer
+    ordering = ('timestamp', 'id')
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = get_created_status()
+        return response
+
+    def perform_create(self, serializer):
+        if acknowledges_on_buffer():
+            serializer.instance = store_states([State(**serializer.validated_data)])[0]
+        else:
+            serializer.save()
 
     def get_queryset(self):
         freight = generics.get_object_or_404(Freight, pk=self.kwargs['freight_pk'])
         rule = generics.get_object_or_404(Rule, pk=self.kwargs['rule_pk'], freight=freight)
-        return State.objects.filter(rule=rule)
+        return filter_states_by_timestamp(State.objects.filter(rule=rule), self.request.query_params)
 
 
 class StateRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
@@ -83,3 +180,80 @@ class StateRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         freight = generics.get_object_or_404(Freight, pk=self.kwargs['freight_pk'])
         rule = generics.get_object_or_404(Rule, pk=self.kwargs['rule_pk'], freight=freight)
         return generics.get_object_or_404(State, pk=self.kwargs['state_pk'], rule=rule)
+
+
+class StateRollupListAPIView(generics.ListAPIView):
+    serializer_class = StateRollupSerializer
+    ordering = ('bucket',)
+
+    def get_queryset(self):
+        freight = generics.get_object_or_404(Freight, pk=self.kwargs['freight_pk'])
+        rule = generics.get_object_or_404(Rule, pk=self.kwargs['rule_pk'], freight=freight)
+
+        filter_serializer = StateRollupFilterSerializer(data=self.request.query_params)
+        filter_serializer.is_valid(raise_exception=True)
+        filters = filter_serializer.validated_data
+
+        rollups = StateRollup.objects.filter(rule=rule, resolution=filters['resolution'])
+        if 'since' in filters:
+            rollups = rollups.filter(bucket__gte=StateRollup.objects.truncate_timestamp(filters['since'],
+                                                                                        filters['resolution']))
+        if 'until' in filters:
+            rollups = rollups.filter(bucket__lt=filters['until'])
+
+        return rollups
+
+
+class StateExportAPIView(views.APIView):
+    def get(self, request, freight_pk=None, rule_pk=None):
+        freight = generics.get_object_or_404(Freight, pk=freight_pk)
+        states = State.objects.filter(rule__freight=freight).order_by('rule', 'timestamp', 'id')
+        filename = f'freight-{freight.pk}-states'
+
+        if rule_pk is not None:
+            rule = generics.get_object_or_404(Rule, pk=rule_pk, freight=freight)
+            states = State.objects.filter(rule=rule).order_by('timestamp', 'id')
+            filename = f'freight-{freight.pk}-rule-{rule.pk}-states'
+
+        states = filter_states_by_timestamp(states, request.query_params)
+
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in RENDERERS:
+            return Response(data={'detail': f'File format must be one of: {", ".join(RENDERERS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        compress = request.query_params.get('gzip', '').lower() in ['true', '1']
+        content_type, chunks = export_states(states, file_format, compress=compress)
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = (f'attachment; filename="{filename}.{file_format}'
+                                           f'{".gz" if compress else ""}"')
+        return response
+
+
+class StateBulkCreateAPIView(views.APIView):
+    def post(self, request):
+        readings = request.data
+
+        batch_error = get_batch_error(readings)
+        if batch_error:
+            return Response(data={'detail': batch_error}, status=status.HTTP_400_BAD_REQUEST)
+
+        created, errors = ingest_readings(readings)
+
+        return Response(data={'created': created, 'errors': errors}, status=get_created_status())
+
+
+class StateBinaryBulkCreateAPIView(views.APIView):
+    parser_classes = [StateFrameParser]
+
+    def post(self, request):
+        records = request.data
+
+        batch_error = get_batch_error(records)
+        if batch_error:
+            return Response(data={'detail': batch_error}, status=status.HTTP_400_BAD_REQUEST)
+
+        created, errors = ingest_records(records)
+
+        return Response(data={'created': created, 'errors': errors}, status=get_created_status())
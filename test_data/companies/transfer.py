@@ -6,7 +6,7 @@ def create_transfer(**fields):
     if not fields.get('delivery_service'):
         fields['delivery_service'] = create_robot_service(type=Service.Type.DELIVERY)
 
-    if not fields.get('r`eception_service'):
+    if not fields.get('reception_service'):
         fields['reception_service'] = create_robot_service(type=Service.Type.RECEPTION)
 
     return Transfer.objects.create(**fields)